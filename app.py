@@ -1,26 +1,40 @@
 from flask import Flask, Response, render_template, send_from_directory, request, jsonify
 from dotenv import load_dotenv
-from ultralytics import YOLO
+load_dotenv()  # before the local modules, which read their settings at import time
 import datetime
 import time
 import cv2
-import subprocess
 import numpy as np
 import db
 import fs
+import capture
+import pipeline
+import detections
+import load_shedding
+import clip_buffer
+import overlay
+import ingest
+import evidence
 import threading
+import queue
+import json
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 import socket
 import signal
 import sys
 import os
 
 SAMBA_MOUNT_POINT = '/mnt/samba'
-load_dotenv()
 
 # Create temporary directory for screenshots
 os.makedirs('screenshots', exist_ok=True)
 
 app = Flask(__name__)
+# Central instances accept batched events from edge sites; edge nodes do not expose the write endpoint
+if ingest.INGEST_SERVER:
+    if not ingest.INGEST_TOKEN:
+        print("Warning: INGEST_SERVER is enabled without INGEST_TOKEN, any client can post events")
+    app.register_blueprint(ingest.ingest_api)
 
 # Camera configuration options
 CAMERA_SOURCES = {
@@ -36,6 +50,7 @@ CAMERA_SOURCES = {
 camera = None
 camera_available = False
 current_camera_source = None  # 添加缺失的全局变量
+camera_source_value = None  # Value passed to capture.open_source for the active camera
 width, height, fps = 640, 480, 30
 
 # Priority order for camera sources
@@ -45,69 +60,306 @@ camera_attempts = [
     ('file', CAMERA_SOURCES['file']),
 ]
 
-print("Attempting to initialize camera...")
-
-for source_name, source_value in camera_attempts:
+def probe_source(source_name, source_value):
+    """Open one candidate source; returns the capture if it works, otherwise None"""
+    camera = None
     try:
         if source_name == 'file':
             # Check if file exists
             if not os.path.exists(source_value):
                 print(f"Video file {source_value} not found, skipping...")
-                continue
-            camera = cv2.VideoCapture(source_value)
+                return None
             print(f"Trying video file: {source_value}")
         else:
-            camera = cv2.VideoCapture(source_value)
             print(f"Trying {source_name} camera (index: {source_value})")
+        camera = capture.open_source(source_value)
         
         if camera.isOpened():
-            # reduce buffer size
-            camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-            
-            # Frame dimensions
-            width = int(camera.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            fps = camera.get(cv2.CAP_PROP_FPS)
-            if fps == 0:  # Some sources return 0 FPS
-                fps = 30
-            
-            print(f"✓ Camera initialized successfully!")
-            print(f"  Source: {source_name}")
-            print(f"  Frame dimensions: {width}x{height}, FPS: {fps}")
-            camera_available = True
-            break
-        else:
-            camera.release()
-            camera = None
-            print(f"✗ {source_name} camera failed to open")
-            
+            return camera
+        camera.release()
+        print(f"✗ {source_name} camera failed to open")
     except Exception as e:
         print(f"✗ {source_name} camera error: {e}")
         if camera:
             camera.release()
-            camera = None
+    return None
 
-if not camera_available:
-    print("✗ All camera sources failed")
-    print("Running in demo mode without camera")
-    camera = None
+def release_late_probe(future):
+    """Release a source whose probe finished after another source was chosen"""
+    try:
+        late_camera = future.result()
+    except Exception:
+        return
+    if late_camera is not None and late_camera is not camera:
+        late_camera.release()
 
-# Load YOLO model (using a lightweight model for demo)
-try:
-    model = YOLO('yolov8n.pt')  # Using nano model for demo
-    print("YOLO model loaded successfully")
-except:
-    print("Warning: YOLO model not found, using mock detection")
-    model = None
+def init_camera():
+    """Probe camera_attempts in parallel and open the highest-priority working source"""
+    global camera, camera_available, camera_source_value, width, height, fps
+
+    print("Attempting to initialize camera...")
+    set_status('camera', 'loading')
+
+    # A failing VideoCapture can block for seconds, so every source is probed at
+    # once and the whole probe is bounded by CAMERA_PROBE_TIMEOUT
+    executor = ThreadPoolExecutor(max_workers=len(camera_attempts), thread_name_prefix='camera-probe')
+    futures = [executor.submit(probe_source, name, value) for name, value in camera_attempts]
+    executor.shutdown(wait=False)
+    deadline = time.time() + CAMERA_PROBE_TIMEOUT
+    
+    chosen = None
+    for (source_name, source_value), future in zip(camera_attempts, futures):
+        if chosen is not None:
+            future.add_done_callback(release_late_probe)
+            continue
+        try:
+            opened = future.result(timeout=max(0, deadline - time.time()))
+        except FutureTimeout:
+            print(f"✗ {source_name} camera timed out")
+            future.add_done_callback(release_late_probe)
+            continue
+        if opened is not None:
+            chosen = (source_name, source_value, opened)
+
+    if chosen is None:
+        print("✗ All camera sources failed")
+        print("Running in demo mode without camera")
+        set_status('camera', 'unavailable')
+        return
+
+    source_name, source_value, opened = chosen
+    # reduce buffer size
+    opened.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    
+    # Frame dimensions
+    width = int(opened.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(opened.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = opened.get(cv2.CAP_PROP_FPS)
+    if fps == 0:  # Some sources return 0 FPS
+        fps = 30
+    
+    print(f"✓ Camera initialized successfully!")
+    print(f"  Source: {source_name}")
+    print(f"  Frame dimensions: {width}x{height}, FPS: {fps}")
+    camera = opened
+    camera_source_value = source_value
+    camera_available = True
+    set_status('camera', 'ready')
+
+def load_model():
+    """Load YOLO model (using a lightweight model for demo) and warm it up"""
+    global model
+    set_status('model', 'loading')
+    try:
+        # Imported here so the web server can bind before torch is loaded
+        from ultralytics import YOLO
+        loaded = YOLO('yolov8n.pt')  # Using nano model for demo
+        print("YOLO model loaded successfully")
+    except Exception:
+        print("Warning: YOLO model not found, using mock detection")
+        set_status('model', 'unavailable')
+        return
+    
+    # The first inference pays for lazy allocations; do it before serving real frames
+    set_status('model', 'warming')
+    try:
+        loaded.predict(np.zeros((480, 640, 3), dtype=np.uint8), verbose=False, **predict_kwargs)
+    except Exception as e:
+        print(f"Model warm-up failed: {e}")
+    model = loaded
+    set_status('model', 'ready')
+
+def background_init():
+    """Probe cameras and load the model concurrently, then start the pipeline if enabled"""
+    # Create and migrate the schema before anything records events; WSGI servers never run __main__
+    db.init_db()
+    # In pipeline mode the inference workers load their own models
+    model_thread = None
+    if not pipeline.PIPELINE_MODE:
+        model_thread = threading.Thread(target=load_model, name='model-loader', daemon=True)
+        model_thread.start()
+    init_camera()
+    if ingest.CENTRAL_INGEST_URL:
+        start_forwarder()
+    if pipeline.PIPELINE_MODE:
+        set_status('pipeline', 'loading')
+        start_pipeline()
+        if frame_pipeline:
+            wait_for_pipeline()
+        else:
+            # No source for the pipeline: serve frames from this process instead
+            set_status('pipeline', 'unavailable')
+            load_model()
+    if model_thread:
+        model_thread.join()
+    print(f"Startup finished in {time.time() - started_at:.2f}s: {component_status}")
+
+def wait_for_pipeline():
+    """The pipeline is ready once every inference worker has loaded its model"""
+    set_status('model', 'loading')
+    if frame_pipeline.wait_ready():
+        set_status('model', 'ready')
+        set_status('pipeline', 'ready')
+    else:
+        print("✗ Pipeline inference workers failed to load the model")
+        set_status('model', 'unavailable')
+        set_status('pipeline', 'unavailable')
+
+def start_forwarder():
+    """Forward locally stored events to the central instance in batches"""
+    global outbox_forwarder
+    outbox_forwarder = ingest.OutboxForwarder()
+    outbox_forwarder.start()
+
+def start_background_init():
+    """Start background initialization once per serving process"""
+    global init_thread
+    with status_lock:
+        if init_thread is not None:
+            return
+        init_thread = threading.Thread(target=background_init, name='startup', daemon=True)
+    init_thread.start()
+
+def set_status(component, state):
+    with status_lock:
+        component_status[component] = state
+
+model = None
+predict_kwargs = dict(conf=0.6, iou=0.8, imgsz=640, half=True, max_det=10, agnostic_nms=True)
+
+# Startup state: cameras and the model are initialized in the background so the
+# server binds immediately; /healthz and /readyz report per-component progress
+CAMERA_PROBE_TIMEOUT = float(os.getenv('CAMERA_PROBE_TIMEOUT', '5'))
+started_at = time.time()
+init_thread = None
+outbox_forwarder = None  # Edge-to-central event forwarder, started when CENTRAL_INGEST_URL is set
+status_lock = threading.Lock()
+component_status = {
+    'camera': 'pending',
+    'model': 'pending',
+    'pipeline': 'pending' if pipeline.PIPELINE_MODE else 'disabled'
+}
 
 now = datetime.datetime.now()
 show_live_camera = True  # Flag to toggle between live camera and uploaded content
 last_screenshot_time = time.time()  # Variable to track the last screenshot time
 screenshot_interval = 5  # Set the interval for taking screenshots (in seconds)
+frame_pipeline = None  # Multi-process pipeline, started when PIPELINE_MODE=1
 
-def generate_frames():
+# Per-stream load shedding; priorities come from STREAM_PRIORITIES, e.g. "0=critical,test_video.mp4=low"
+load_controller = load_shedding.LoadShedController()
+stream_priorities = load_shedding.parse_priorities(os.getenv('STREAM_PRIORITIES', ''))
+
+# Recent encoded frames per stream, turned into pre/post-event clips on violations
+clip_buffers = {}
+clip_buffers_lock = threading.Lock()
+
+# Detection metadata for browsers that draw the overlay themselves
+detection_hub = overlay.DetectionHub()
+CLIENT_OVERLAY = os.getenv('CLIENT_OVERLAY', '0') == '1'  # pipeline mode: stream frames without baked-in boxes
+DETECTION_TRACKING = os.getenv('DETECTION_TRACKING', '0') == '1'  # use model.track() to get track IDs
+
+def multipart_frame(frame_bytes, seq, timestamp):
+    """One multipart/x-mixed-replace part; the extra headers let clients sync overlays"""
+    return (b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n'
+            b'Content-Length: %d\r\n'
+            b'X-Frame-Seq: %d\r\n'
+            b'X-Frame-Timestamp: %.3f\r\n\r\n' % (len(frame_bytes), seq, timestamp)
+            + frame_bytes + b'\r\n')
+
+def client_overlay_available():
+    """Browser-side boxes need unannotated frames: always available in single-process mode,
+    in pipeline mode only when the pipeline streams without baked-in boxes (CLIENT_OVERLAY=1)"""
+    return not pipeline.PIPELINE_MODE or CLIENT_OVERLAY
+
+def get_clip_buffer(stream):
+    with clip_buffers_lock:
+        if stream not in clip_buffers:
+            clip_buffers[stream] = clip_buffer.ClipBuffer(stream)
+        return clip_buffers[stream]
+
+def start_pipeline():
+    """Start the multi-process capture/inference pipeline for the configured sources"""
+    global frame_pipeline, camera, camera_available
+    sources = pipeline.PIPELINE_SOURCES or ([camera_source_value] if camera_source_value is not None else [])
+    if not sources:
+        print("Pipeline mode enabled but no video source available, staying in single-process mode")
+        return
+    
+    # The capture processes open the sources themselves
+    if camera:
+        camera.release()
+        camera = None
+        camera_available = False
+    
+    frame_pipeline = pipeline.Pipeline(
+        sources,
+        workers=pipeline.PIPELINE_WORKERS,
+        predict_kwargs=predict_kwargs,
+        on_detection=pipeline_detection,
+        on_frame=pipeline_frame,
+        controller=load_controller,
+        priorities=stream_priorities,
+        annotate=not CLIENT_OVERLAY
+    )
+    frame_pipeline.start()
+
+def pipeline_detection(stream_index, frame, dets, names):
+    """Rate-limited screenshot for detections coming out of the pipeline"""
     global last_screenshot_time
+    current_time = time.time()
+    if current_time - last_screenshot_time >= screenshot_interval:
+        stream = frame_pipeline.stream_names[stream_index]
+        # The slot is only annotated when the stream's knobs say so; evidence always shows the boxes
+        image = detections.draw(frame.copy(), dets, names)
+        screenshot_thread = threading.Thread(target=save_evidence, args=(image, detections.class_ids(dets), stream))
+        screenshot_thread.start()
+        last_screenshot_time = current_time
+
+def pipeline_frame(stream_index, seq, frame_bytes, captured_at, dets, shape):
+    """Keep every encoded pipeline frame for event clips and publish its detections"""
+    get_clip_buffer(frame_pipeline.stream_names[stream_index]).add(frame_bytes, captured_at)
+    channel = f'stream-{stream_index}'
+    if detection_hub.has_subscribers(channel):
+        detection_hub.publish(channel, overlay.to_message(seq, dets, shape))
+
+def generate_pipeline_frames(stream_index=0):
+    """Stream the latest annotated frames published by the pipeline"""
+    seq = 0
+    stream = frame_pipeline.stream_names[stream_index]
     while True:
+        started = time.time()
+        new_seq, frame_bytes, captured_at = frame_pipeline.latest_frame(stream_index, after_seq=seq)
+        if new_seq == seq or frame_bytes is None:
+            continue
+        seq = new_seq
+        
+        # Cap the output frame rate
+        remaining = 1.0 / load_controller.knobs(stream)['fps'] - (time.time() - started)
+        if remaining > 0:
+            time.sleep(remaining)
+        yield multipart_frame(frame_bytes, seq, captured_at)
+
+def stream_name():
+    """Load-shedding key of the active source"""
+    return str(camera_source_value) if camera_available and camera else 'demo'
+
+def register_stream(name, source_fps):
+    return load_controller.register(name, stream_priorities.get(name, 'normal'), source_fps)
+
+def generate_frames(overlay_client=None):
+    """MJPEG frames for one viewer; with overlay_client, boxes go to the detection hub instead of the JPEG"""
+    global last_screenshot_time
+    frame_index = 0
+    last_dets = detections.empty()
+    while True:
+        started = time.time()
+        stream = stream_name()
+        register_stream(stream, fps)
+        knobs = load_controller.knobs(stream)
+        frame_index += 1
+        
         if camera_available and camera:
             # Read a frame from the webcam
             success, frame = camera.read()
@@ -123,35 +375,66 @@ def generate_frames():
             # Create demo frame when camera is not available
             frame = create_demo_frame()
         
+        # Load is judged by processing time only; waiting for the source's next frame is not load
+        processing_started = time.time()
+        
         # Run object detection on the frame
         if model:
-            results = model.predict(frame, conf=0.6, iou=0.8, imgsz=640, half=True, max_det=10, stream_buffer=True, agnostic_nms=True, vid_stride=12)
-            
-            # Perform detection
-            if results and results[0].boxes:
-                current_time = time.time()
-                if current_time - last_screenshot_time >= screenshot_interval:
-                    screenshot_thread = threading.Thread(target=take_screenshot, args=(results,))
-                    screenshot_thread.start()
-                    last_screenshot_time = current_time
+            # Detection stride and input size are set per stream by the load-shedding controller
+            if (frame_index - 1) % knobs['stride'] == 0:
+                if DETECTION_TRACKING:
+                    results = model.track(frame, persist=True, conf=0.6, iou=0.8, imgsz=knobs['imgsz'], half=True, max_det=10, agnostic_nms=True)
+                else:
+                    results = model.predict(frame, conf=0.6, iou=0.8, imgsz=knobs['imgsz'], half=True, max_det=10, agnostic_nms=True)
+                last_dets = detections.to_array(results[0]) if results else detections.empty()
                 
-                # Draw bounding boxes and labels on the frame
-                detected_frame = results[0].plot()
-                print(f"Detected classes: {results[0].boxes.cls.numpy()}")
+                # Perform detection
+                if results and results[0].boxes:
+                    current_time = time.time()
+                    if current_time - last_screenshot_time >= screenshot_interval:
+                        screenshot_thread = threading.Thread(target=take_screenshot, args=(results, stream))
+                        screenshot_thread.start()
+                        last_screenshot_time = current_time
+                    print(f"Detected classes: {results[0].boxes.cls.numpy()}")
+            
+            # Draw bounding boxes and labels on the frame; skipped frames reuse the last detections
+            if overlay_client:
+                detection_hub.publish(overlay_client, overlay.to_message(frame_index, last_dets, frame.shape))
+                detected_frame = frame
+            elif knobs['annotate'] and len(last_dets):
+                detected_frame = detections.draw(frame.copy(), last_dets, model.names)
             else:
                 detected_frame = frame
         else:
             # Mock detection for demo
             detected_frame = frame.copy()
-            cv2.putText(detected_frame, "Demo Mode - No Model Loaded", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+            if component_status['model'] == 'unavailable':
+                cv2.putText(detected_frame, "Demo Mode - No Model Loaded", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+            else:
+                cv2.putText(detected_frame, "Loading Model...", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
         
         # Convert the frame to JPEG format
-        ret, buffer = cv2.imencode('.jpg', detected_frame, [int(cv2.IMWRITE_JPEG_QUALITY), 90])
+        ret, buffer = cv2.imencode('.jpg', detected_frame, [int(cv2.IMWRITE_JPEG_QUALITY), knobs['jpeg_quality']])
         frame_bytes = buffer.tobytes()
+        get_clip_buffer(stream).add(frame_bytes)
+        
+        load_controller.report(stream, time.time() - processing_started)
+        elapsed = time.time() - started
+        
+        current_camera = camera
+        if current_camera and isinstance(camera_source_value, str) and os.path.exists(camera_source_value):
+            # Video files do not drop frames on their own: skip what we had no time for
+            lag_frames = int(elapsed * fps) - 1
+            for _ in range(min(lag_frames, int(fps))):
+                current_camera.grab()
+        
+        # Cap the output frame rate
+        remaining = 1.0 / knobs['fps'] - elapsed
+        if remaining > 0:
+            time.sleep(remaining)
         
         # Use a multipart response to continuously send frames
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+        yield multipart_frame(frame_bytes, frame_index, started)
 
 def create_demo_frame():
     """Create a demo frame when camera is not available"""
@@ -171,8 +454,15 @@ def create_demo_frame():
     
     return frame
 
-def take_screenshot(results):
+def take_screenshot(results, stream=None):
     '''Takes a Screenshot and saves it to a file server and its metadata in a database'''
+    if results and results[0].boxes:
+        save_evidence(results[0].plot(), results[0].boxes.cls.numpy().copy(), stream)
+    else:
+        save_evidence(None, None, stream)
+
+def save_evidence(image, classArray, stream=None):
+    '''Saves an annotated frame and the missing PPE classes of its detections'''
     # Setting up screenshot and metadata
     hostname = socket.gethostname()
     current_time = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
@@ -181,30 +471,36 @@ def take_screenshot(results):
     # temporary local storage location
     fileName = screenshot_fileLoc[len('screenshots/'):-len('.jpg')]
     
+    # Record a pre/post-event clip from the stream's buffer; it is linked to the event once written
+    if stream is not None:
+        get_clip_buffer(stream).trigger(fileName, on_done=db.attach_clip)
+    
     # Create an array storing the frequencies of objects (PPE items)
     # For demo: person, bicycle, car, motorcycle, airplane, bus
     completeArr = [0, 1, 2, 3, 5, 7]
     
-    if results and results[0].boxes:
-        classArray = results[0].boxes.cls.numpy().copy()
+    if image is not None:
         notFoundArr = np.setdiff1d(np.array(completeArr), np.array(classArray)).tolist()
         print("NOTFound" + str(notFoundArr))
         
         # Temporarily stores screenshot to local directory
-        cv2.imwrite(screenshot_fileLoc, results[0].plot())
+        cv2.imwrite(screenshot_fileLoc, image)
+        store_evidence(image, screenshot_fileLoc, fileName)
         
         # Add screenshot metadata to Database
         for value in notFoundArr:
-            db.upload_metadata(fileName, 'screenshots', hostname, datetime.datetime.now(), int(value + 1))
+            db.upload_metadata(fileName, evidence.EVIDENCE_DIR, hostname, datetime.datetime.now(), int(value + 1))
     else:
         # Mock data for demo
         notFoundArr = [1, 3, 5]  # bicycle, motorcycle, bus not found
-        cv2.imwrite(screenshot_fileLoc, np.zeros((480, 640, 3), dtype=np.uint8))
+        image = np.zeros((480, 640, 3), dtype=np.uint8)
+        cv2.imwrite(screenshot_fileLoc, image)
+        store_evidence(image, screenshot_fileLoc, fileName)
         print("NOTFound" + str(notFoundArr))
         
         # Add mock metadata to Database
         for value in notFoundArr:
-            db.upload_metadata(fileName, 'screenshots', hostname, datetime.datetime.now(), int(value + 1))
+            db.upload_metadata(fileName, evidence.EVIDENCE_DIR, hostname, datetime.datetime.now(), int(value + 1))
     
     # Delete Excess Photos from temp directory
     try:
@@ -215,6 +511,11 @@ def take_screenshot(results):
     except Exception as e:
         print(f"An error occurred: {e}")
 
+def store_evidence(image, screenshot_fileLoc, fileName):
+    """Copies a screenshot to the evidence store and queues its thumbnail/medium renditions"""
+    if fs.putSamba(screenshot_fileLoc, os.path.join(evidence.EVIDENCE_DIR, evidence.image_name(fileName))):
+        evidence.submit_renditions(image, fileName)
+
 def empty_temp():
     """Removes any pictures in temporary folder"""
     try:
@@ -232,20 +533,59 @@ def empty_temp():
 
 def cleanup():
     empty_temp()
+    if frame_pipeline:
+        frame_pipeline.stop()
     if camera_available and camera:
         camera.release()
     sys.exit(0)
 
+@app.before_request
+def ensure_initialized():
+    # Covers WSGI servers that import the app without running __main__
+    start_background_init()
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the server is up; reports the state of each component"""
+    with status_lock:
+        components = dict(component_status)
+    return jsonify({
+        "status": "serving",
+        "uptime": round(time.time() - started_at, 3),
+        "components": components
+    })
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: 200 once the model is warm and no component is still initializing"""
+    with status_lock:
+        components = dict(component_status)
+    pending = [name for name, state in components.items() if state in ('pending', 'loading', 'warming')]
+    ready = not pending and components['model'] == 'ready'
+    return jsonify({
+        "ready": ready,
+        "pending": pending,
+        "components": components
+    }), 200 if ready else 503
+
+@app.route('/api/status')
+def api_status():
+    """System status polled by main.js"""
+    with status_lock:
+        components = dict(component_status)
+    healthy = components['model'] == 'ready' and components['camera'] != 'pending'
+    return jsonify({"status": "healthy" if healthy else "starting", "components": components})
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'GET':
         # A simple HTML page with an embedded video stream
-        return render_template('index.html')
+        return render_template('index.html', client_overlay=client_overlay_available())
     elif request.method == 'POST':
         data = request.json
         # Process the received data
         print(data)
-        return render_template('index.html', data=data), 200
+        return render_template('index.html', data=data, client_overlay=client_overlay_available()), 200
     else:
         # Handle unexpected HTTP methods
         return jsonify({'status': 'failure'}), 405
@@ -253,7 +593,50 @@ def index():
 @app.route('/video_feed')
 def video_feed():
     # Stream the video feed as multipart content
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    if frame_pipeline:
+        stream_index = request.args.get('stream', 0, type=int)
+        if not 0 <= stream_index < len(frame_pipeline.sources):
+            return "Stream not found", 404
+        return Response(generate_pipeline_frames(stream_index), mimetype='multipart/x-mixed-replace; boundary=frame')
+    # ?overlay=1&client=<id>: raw frames, detections are sent on /detections?client=<id>
+    overlay_client = request.args.get('client') if request.args.get('overlay') == '1' else None
+    return Response(generate_frames(overlay_client), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route('/detections')
+def detection_events():
+    """Server-sent events with compact per-frame detection metadata for client-side overlays"""
+    if frame_pipeline:
+        channel = f"stream-{request.args.get('stream', 0, type=int)}"
+        names = frame_pipeline.names
+    else:
+        channel = request.args.get('client')
+        if not channel:
+            return jsonify({"error": "client parameter required"}), 400
+        names = model.names if model else {}
+    subscriber = detection_hub.subscribe(channel)
+    
+    def events():
+        try:
+            yield overlay.sse(json.dumps({str(k): v for k, v in dict(names).items()}), event='names')
+            while True:
+                try:
+                    yield overlay.sse(subscriber.get(timeout=15))
+                except queue.Empty:
+                    # Keep idle connections alive through proxies
+                    yield ': keepalive\n\n'
+        finally:
+            detection_hub.unsubscribe(channel, subscriber)
+    
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/pipeline_status')
+def pipeline_status():
+    """Return multi-process pipeline statistics"""
+    if not frame_pipeline:
+        return jsonify({"enabled": False})
+    stats = frame_pipeline.stats()
+    stats["enabled"] = True
+    return jsonify(stats)
 
 @app.route('/updates')
 def logs():
@@ -273,11 +656,44 @@ def update():
 
 @app.route('/images/<path:filename>')
 def serve_image(filename):
+    """Evidence image in the requested rendition (?size=thumb|medium|full)"""
+    size = request.args.get('size', 'full')
+    if size != 'full' and size not in evidence.RENDITIONS:
+        return "Unknown image size", 400
+    if os.path.basename(filename) != filename or filename.startswith('.'):
+        return "Image not found", 404
     try:
-        return send_from_directory('screenshots', filename + ".jpg")
+        path = evidence.rendition_path(filename, size)
+        # Evidence never changes once written: cache it for a year. conditional=True adds
+        # ETag/Last-Modified, answers If-None-Match/If-Modified-Since with 304 and serves Range requests
+        response = send_from_directory(evidence.EVIDENCE_DIR, os.path.basename(path),
+                                       conditional=True, etag=True, max_age=31536000)
+        response.cache_control.immutable = True
+        return response
     except:
         return "Image not found", 404
 
+@app.route('/load_shedding')
+def load_shedding_status():
+    """Return per-stream load-shedding knobs and recent decisions"""
+    return jsonify(load_controller.status())
+
+@app.route('/clips/<path:filename>')
+def serve_clip(filename):
+    try:
+        return send_from_directory(clip_buffer.CLIP_DIR, filename + ".mp4")
+    except:
+        return "Clip not found", 404
+
+@app.route('/outbox_status')
+def outbox_status():
+    """Return the edge outbox forwarding state"""
+    if not outbox_forwarder:
+        return jsonify({"enabled": False})
+    status = outbox_forwarder.status()
+    status["enabled"] = True
+    return jsonify(status)
+
 @app.route('/camera_status')
 def camera_status():
     """返回当前摄像头状态"""
@@ -303,12 +719,18 @@ def camera_status():
 @app.route('/switch_camera', methods=['POST'])
 def switch_camera():
     """切换摄像头源"""
-    global camera, camera_available, current_camera_source, width, height, fps
+    global camera, camera_available, current_camera_source, camera_source_value, width, height, fps
+    
+    if frame_pipeline:
+        return jsonify({"success": False, "error": "多进程流水线模式下不支持切换视频源"})
     
     try:
         data = request.get_json()
         new_source = data.get('source', 'demo')
         
+        # 旧视频源不再参与负载调节
+        load_controller.unregister(stream_name())
+        
         # 释放当前摄像头
         if camera and camera.isOpened():
             camera.release()
@@ -321,15 +743,17 @@ def switch_camera():
             camera = None
             camera_available = False
             current_camera_source = "demo"
+            camera_source_value = None
             width, height, fps = 640, 480, 30
             
         elif new_source == "test_video.mp4":
             # 测试视频文件
             if os.path.exists(new_source):
-                camera = cv2.VideoCapture(new_source)
+                camera = capture.open_source(new_source)
                 if camera.isOpened():
                     camera_available = True
                     current_camera_source = new_source
+                    camera_source_value = new_source
                     width = int(camera.get(cv2.CAP_PROP_FRAME_WIDTH))
                     height = int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT))
                     fps = camera.get(cv2.CAP_PROP_FPS) or 30
@@ -343,10 +767,11 @@ def switch_camera():
                 
         elif new_source == "virtual":
             # 虚拟摄像头 (v4l2loopback)
-            camera = cv2.VideoCapture(10)  # 通常虚拟设备在 /dev/video10
+            camera = capture.open_source(10)  # 通常虚拟设备在 /dev/video10
             if camera.isOpened():
                 camera_available = True
                 current_camera_source = "virtual"
+                camera_source_value = 10
                 width = int(camera.get(cv2.CAP_PROP_FRAME_WIDTH))
                 height = int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT))
                 fps = camera.get(cv2.CAP_PROP_FPS) or 30
@@ -359,10 +784,11 @@ def switch_camera():
         elif new_source in ["0", "1", "2"]:
             # 物理摄像头
             device_id = int(new_source)
-            camera = cv2.VideoCapture(device_id)
+            camera = capture.open_source(device_id)
             if camera.isOpened():
                 camera_available = True
                 current_camera_source = f"摄像头{device_id}"
+                camera_source_value = device_id
                 width = int(camera.get(cv2.CAP_PROP_FRAME_WIDTH))
                 height = int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT))
                 fps = camera.get(cv2.CAP_PROP_FPS) or 30
@@ -376,10 +802,11 @@ def switch_camera():
                 return jsonify({"success": False, "error": f"无法打开摄像头设备{device_id}"})
         else:
             # 网络流或其他URL
-            camera = cv2.VideoCapture(new_source)
+            camera = capture.open_source(new_source)
             if camera.isOpened():
                 camera_available = True
                 current_camera_source = new_source
+                camera_source_value = new_source
                 width = int(camera.get(cv2.CAP_PROP_FRAME_WIDTH))
                 height = int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT))
                 fps = camera.get(cv2.CAP_PROP_FPS) or 30
@@ -410,6 +837,10 @@ if __name__ == '__main__':
         db.init_db()
         print("Database initialized")
         
+        # With debug=True the reloader runs this block twice; only the serving child initializes
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_background_init()
+        
         app.run(debug=True, threaded=True, host='0.0.0.0', port=3000)
     except KeyboardInterrupt:
         cleanup()
\ No newline at end of file
@@ -0,0 +1,258 @@
+import subprocess
+import threading
+import select
+import json
+import time
+import cv2
+import numpy as np
+import os
+
+# Capture backend: 'opencv' uses cv2.VideoCapture, 'ffmpeg' decodes through an ffmpeg subprocess
+CAPTURE_BACKEND = os.getenv('CAPTURE_BACKEND', 'opencv')
+FFMPEG_BIN = os.getenv('FFMPEG_BIN', 'ffmpeg')
+FFPROBE_BIN = os.getenv('FFPROBE_BIN', 'ffprobe')
+
+# Frames are scaled to this width inside ffmpeg (height follows the source aspect ratio)
+FFMPEG_SCALE_WIDTH = int(os.getenv('FFMPEG_SCALE_WIDTH', '640'))
+FFMPEG_THREADS = int(os.getenv('FFMPEG_THREADS', '1'))
+RTSP_TRANSPORT = os.getenv('RTSP_TRANSPORT', 'tcp')
+# Seconds without data before a stream counts as stalled (also bounds opening a source)
+FFMPEG_TIMEOUT = float(os.getenv('FFMPEG_TIMEOUT', '10'))
+
+
+class FFmpegCapture:
+    """Minimal cv2.VideoCapture replacement backed by an ffmpeg subprocess.
+
+    ffmpeg decodes and scales to the inference resolution, and raw BGR frames
+    are read straight into preallocated NumPy buffers with readinto(). The
+    frame returned by read() is one of `buffers` rotating arrays, so it is
+    only valid until that many further reads; copy it if it must live longer.
+    When the stream drops or stalls, the process is restarted with exponential
+    backoff. The source only counts as opened once its first frame arrived.
+    read() is serialized with a lock, since several viewers may share one
+    capture and interleaved reads from the pipe would tear frames.
+    """
+
+    def __init__(self, source, width=None, height=None, fps=None, buffers=3,
+                 backoff_initial=0.5, backoff_max=30.0, timeout=FFMPEG_TIMEOUT):
+        self.source = source
+        self.timeout = timeout
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.backoff = backoff_initial
+        self.next_retry = 0.0
+        self.process = None
+        self.frame_count = 0
+        self.opened = False
+        self.pending = None
+        self.lock = threading.Lock()
+
+        src_width, src_height, src_fps = probe_source(source)
+        if width is None:
+            width = FFMPEG_SCALE_WIDTH
+        if height is None:
+            if src_width and src_height:
+                height = int(round(width * src_height / src_width / 2)) * 2
+            else:
+                height = width * 3 // 4
+        self.width = int(width)
+        self.height = int(height)
+        self.fps = fps or src_fps or 30
+
+        self.frame_size = self.width * self.height * 3
+        self.buffers = [np.empty((self.height, self.width, 3), dtype=np.uint8) for _ in range(max(1, buffers))]
+        self.views = [memoryview(buf).cast('B') for buf in self.buffers]
+        self.index = 0
+
+        # Popen succeeds even for unreachable sources; wait for real data before reporting opened
+        if self._start():
+            success, frame = self._read_frame()
+            if success:
+                self.opened = True
+                self.pending = frame
+            else:
+                self._stop()
+                print(f"ffmpeg could not open {source}: no frame within {self.timeout:.0f}s")
+
+    def _command(self):
+        """Build the ffmpeg command line for the configured source"""
+        cmd = [FFMPEG_BIN, '-hide_banner', '-loglevel', 'error', '-nostdin']
+        source = self.source
+        if isinstance(source, int):
+            # Camera index, read through Video4Linux
+            cmd += ['-f', 'v4l2', '-i', f'/dev/video{source}']
+        else:
+            # I/O timeouts (in microseconds) make ffmpeg exit on a stalled network stream
+            io_timeout = str(int(self.timeout * 1000000))
+            if source.startswith('rtsp://'):
+                cmd += ['-rtsp_transport', RTSP_TRANSPORT, '-timeout', io_timeout]
+            elif '://' in source:
+                cmd += ['-rw_timeout', io_timeout]
+            elif os.path.exists(source):
+                # Pace files at their native rate, like a live source
+                cmd += ['-re']
+            cmd += ['-threads', str(FFMPEG_THREADS), '-i', source]
+        cmd += [
+            '-an', '-sn',
+            '-vf', f'scale={self.width}:{self.height}',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24',
+            'pipe:1'
+        ]
+        return cmd
+
+    def _start(self):
+        try:
+            self.process = subprocess.Popen(
+                self._command(),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                stdin=subprocess.DEVNULL,
+                bufsize=0  # unbuffered, so select() sees exactly what is left to read
+            )
+            print(f"ffmpeg capture started: {self.source} -> {self.width}x{self.height}")
+            return True
+        except Exception as e:
+            print(f"Error starting ffmpeg for {self.source}: {e}")
+            self.process = None
+            return False
+
+    def _stop(self):
+        if self.process is not None:
+            try:
+                self.process.kill()
+                self.process.wait(timeout=2)
+            except Exception:
+                pass
+            if self.process.stdout:
+                self.process.stdout.close()
+            self.process = None
+
+    def _schedule_reconnect(self):
+        """Stop the dead process and wait `backoff` seconds before the next attempt"""
+        self._stop()
+        self.next_retry = time.time() + self.backoff
+        print(f"ffmpeg stream {self.source} dropped, reconnecting in {self.backoff:.1f}s")
+        self.backoff = min(self.backoff * 2, self.backoff_max)
+
+    def isOpened(self):
+        # A stream that was opened stays open while it reconnects
+        return self.opened
+
+    def _read_frame(self):
+        """Read one raw frame into the next buffer; fails on EOF or after `timeout` seconds without data"""
+        view = self.views[self.index]
+        stdout = self.process.stdout
+        received = 0
+        try:
+            while received < self.frame_size:
+                ready, _, _ = select.select([stdout], [], [], self.timeout)
+                if not ready:
+                    print(f"ffmpeg stream {self.source} stalled for {self.timeout:.0f}s")
+                    break
+                n = stdout.readinto(view[received:])
+                if not n:
+                    break
+                received += n
+        except Exception as e:
+            print(f"Error reading from ffmpeg: {e}")
+
+        if received < self.frame_size:
+            return False, None
+
+        frame = self.buffers[self.index]
+        self.index = (self.index + 1) % len(self.buffers)
+        self.frame_count += 1
+        return True, frame
+
+    def read(self):
+        """Read the next frame. Returns (success, frame) like cv2.VideoCapture"""
+        with self.lock:
+            return self._read()
+
+    def _read(self):
+        if not self.opened:
+            return False, None
+        if self.pending is not None:
+            # The frame read while opening
+            frame, self.pending = self.pending, None
+            return True, frame
+        if self.process is None:
+            # Still backing off: fail fast so the caller can show a placeholder frame
+            if time.time() < self.next_retry or not self._start():
+                return False, None
+
+        success, frame = self._read_frame()
+        if not success:
+            self._schedule_reconnect()
+            return False, None
+
+        self.backoff = self.backoff_initial
+        self.next_retry = 0.0
+        return True, frame
+
+    def grab(self):
+        """Read and discard one frame, like cv2.VideoCapture.grab()"""
+        return self.read()[0]
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.height
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.frame_count
+        return 0
+
+    def set(self, prop, value):
+        # ffmpeg already delivers only the latest frames; nothing to tune at runtime
+        return False
+
+    def release(self):
+        self._stop()
+        self.opened = False
+        self.pending = None
+        self.next_retry = 0.0
+
+
+def probe_source(source):
+    """Return (width, height, fps) of a source using ffprobe, or Nones if unknown"""
+    cmd = [FFPROBE_BIN, '-v', 'error', '-select_streams', 'v:0',
+           '-show_entries', 'stream=width,height,avg_frame_rate', '-of', 'json']
+    if isinstance(source, int):
+        # Camera index: probe the Video4Linux device for its native size
+        cmd += ['-f', 'v4l2', f'/dev/video{source}']
+    else:
+        if source.startswith('rtsp://'):
+            cmd += ['-rtsp_transport', RTSP_TRANSPORT]
+        cmd.append(source)
+    try:
+        output = subprocess.run(cmd, capture_output=True, timeout=10, check=True).stdout
+        stream = json.loads(output)['streams'][0]
+        num, _, den = stream.get('avg_frame_rate', '0/1').partition('/')
+        fps = float(num) / float(den) if den and float(den) else None
+        return stream.get('width'), stream.get('height'), fps or None
+    except Exception as e:
+        print(f"Could not probe {source} with ffprobe ({e}), trying OpenCV")
+    return probe_opencv(source)
+
+
+def probe_opencv(source):
+    """Fallback probe through cv2.VideoCapture; returns (width, height, fps) or Nones"""
+    camera = cv2.VideoCapture(source)
+    try:
+        if not camera.isOpened():
+            return None, None, None
+        width = int(camera.get(cv2.CAP_PROP_FRAME_WIDTH)) or None
+        height = int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT)) or None
+        return width, height, camera.get(cv2.CAP_PROP_FPS) or None
+    finally:
+        camera.release()
+
+
+def open_source(source):
+    """Open a capture for a camera index, file path or stream URL using the configured backend"""
+    if CAPTURE_BACKEND == 'ffmpeg':
+        return FFmpegCapture(source)
+    return cv2.VideoCapture(source)
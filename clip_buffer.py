@@ -0,0 +1,202 @@
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import subprocess
+import threading
+import time
+import cv2
+import numpy as np
+import capture
+import os
+
+# Each stream keeps the last CLIP_PRE_SECONDS of already-encoded JPEG frames in
+# memory (bounded by CLIP_MAX_BYTES); a violation turns them plus the next
+# CLIP_POST_SECONDS into an MP4 clip written in the background
+CLIP_DIR = os.path.abspath(os.getenv('CLIP_DIR', 'clips'))
+CLIP_PRE_SECONDS = float(os.getenv('CLIP_PRE_SECONDS', '10'))
+CLIP_POST_SECONDS = float(os.getenv('CLIP_POST_SECONDS', '5'))
+CLIP_MAX_BYTES = int(os.getenv('CLIP_MAX_BYTES', str(32 * 1024 * 1024)))
+CLIP_MAX_RECORDINGS = 4  # concurrent post-event recordings per stream
+
+# Clips are encoded to H.264 by the ffmpeg binary, which browsers play in <video>.
+# Without ffmpeg, OpenCV is tried; stock opencv-python wheels have no H.264
+# encoder and fall back to MPEG-4 Part 2, which browsers do not play.
+CLIP_X264_PRESET = os.getenv('CLIP_X264_PRESET', 'veryfast')
+CLIP_FOURCCS = ('avc1', 'mp4v')
+BROWSER_CODECS = ('h264', 'avc1')
+
+clip_writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix='clip-writer')
+
+
+class ClipBuffer:
+    """Bounded in-memory ring of (timestamp, jpeg bytes) for one stream"""
+
+    def __init__(self, name, pre_seconds=CLIP_PRE_SECONDS, post_seconds=CLIP_POST_SECONDS,
+                 max_bytes=CLIP_MAX_BYTES, clip_dir=CLIP_DIR):
+        self.name = name
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.max_bytes = max_bytes
+        self.clip_dir = clip_dir
+        self.frames = collections.deque()
+        self.size = 0
+        self.recordings = []
+        self.lock = threading.Lock()
+
+    def add(self, jpeg, timestamp=None):
+        """Append an encoded frame, evict expired ones and feed active recordings"""
+        timestamp = timestamp or time.time()
+        finished = []
+        with self.lock:
+            self.frames.append((timestamp, jpeg))
+            self.size += len(jpeg)
+            while self.frames and (self.size > self.max_bytes or self.frames[0][0] < timestamp - self.pre_seconds):
+                self.size -= len(self.frames.popleft()[1])
+
+            for recording in self.recordings:
+                recording['frames'].append((timestamp, jpeg))
+                if timestamp >= recording['deadline']:
+                    finished.append(recording)
+            for recording in finished:
+                self.recordings.remove(recording)
+
+        for recording in finished:
+            clip_writer.submit(self._write, recording)
+
+    def finish_due(self):
+        """Write recordings whose deadline passed even if the stream stopped delivering frames"""
+        now = time.time()
+        with self.lock:
+            finished = [recording for recording in self.recordings if recording['deadline'] <= now]
+            for recording in finished:
+                self.recordings.remove(recording)
+        for recording in finished:
+            clip_writer.submit(self._write, recording)
+
+    def trigger(self, event_name, on_done=None):
+        """Start a clip around now: the buffered pre-event frames plus post_seconds more"""
+        with self.lock:
+            if len(self.recordings) >= CLIP_MAX_RECORDINGS:
+                print(f"Clip for {event_name} skipped: too many recordings in progress on {self.name}")
+                return False
+            self.recordings.append({
+                'event': event_name,
+                'frames': list(self.frames),
+                'deadline': time.time() + self.post_seconds,
+                'on_done': on_done
+            })
+        # Normally the first frame after the deadline finishes the recording; this covers
+        # a stream that stops (last viewer gone, source switched) before then
+        timer = threading.Timer(self.post_seconds + 1.0, self.finish_due)
+        timer.daemon = True
+        timer.start()
+        return True
+
+    def _write(self, recording):
+        os.makedirs(self.clip_dir, exist_ok=True)
+        clip_path = os.path.join(self.clip_dir, recording['event'] + '.mp4')
+        # Only clips the dashboard can play are linked to their event
+        if write_clip(clip_path, recording['frames']) and recording['on_done']:
+            recording['on_done'](recording['event'], clip_path)
+
+    def stats(self):
+        with self.lock:
+            span = self.frames[-1][0] - self.frames[0][0] if len(self.frames) > 1 else 0.0
+            return {
+                'frames': len(self.frames),
+                'bytes': self.size,
+                'seconds': round(span, 1),
+                'recordings': len(self.recordings)
+            }
+
+
+def write_clip(clip_path, frames):
+    """Write buffered JPEG frames as an MP4 clip; True if a browser-playable clip was saved"""
+    if len(frames) < 2:
+        print(f"Not enough frames for clip {clip_path}")
+        return False
+
+    # Frames arrive at a variable rate; use the average over the clip
+    duration = frames[-1][0] - frames[0][0]
+    fps = max(1.0, (len(frames) - 1) / duration) if duration > 0 else 30.0
+    first = cv2.imdecode(np.frombuffer(frames[0][1], dtype=np.uint8), cv2.IMREAD_COLOR)
+    if first is None:
+        return False
+    # H.264 with 4:2:0 chroma needs even dimensions
+    size = (first.shape[1] // 2 * 2, first.shape[0] // 2 * 2)
+
+    # Write to a temporary file so a half-written clip is never served
+    # (OpenCV picks the container from the extension, so keep .mp4 last)
+    tmp_path = os.path.splitext(clip_path)[0] + '.part.mp4'
+    codec = encode_ffmpeg(tmp_path, frames, fps, size) or encode_opencv(tmp_path, frames, fps, size)
+    if codec is None:
+        print(f"Error creating clip {clip_path}: no usable MP4 encoder")
+        return False
+
+    try:
+        os.replace(tmp_path, clip_path)
+        print(f"Clip saved: {clip_path} ({len(frames)} frames, {duration:.1f}s, {codec})")
+    except Exception as e:
+        print(f"Error saving clip {clip_path}: {e}")
+        return False
+
+    if codec not in BROWSER_CODECS:
+        print(f"Clip {clip_path} is {codec}, which browsers cannot play; install ffmpeg to get H.264 clips")
+        return False
+    return True
+
+
+def encode_ffmpeg(path, frames, fps, size):
+    """Pipe the JPEG frames through ffmpeg into H.264 with the index up front for progressive playback"""
+    cmd = [
+        capture.FFMPEG_BIN, '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'image2pipe', '-c:v', 'mjpeg', '-framerate', f'{fps:.3f}', '-i', 'pipe:0',
+        '-vf', f'scale={size[0]}:{size[1]},setsar=1',
+        '-c:v', 'libx264', '-preset', CLIP_X264_PRESET, '-pix_fmt', 'yuv420p',
+        '-movflags', '+faststart', path
+    ]
+    try:
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except Exception as e:
+        print(f"ffmpeg not available for clip encoding: {e}")
+        return None
+
+    try:
+        for timestamp, jpeg in frames:
+            process.stdin.write(jpeg)
+        # communicate() closes stdin, which ends the input
+        stderr = process.communicate(timeout=120)[1]
+    except Exception as e:
+        process.kill()
+        process.wait()
+        print(f"Error encoding clip with ffmpeg: {e}")
+        return None
+
+    if process.returncode != 0:
+        print(f"ffmpeg failed to encode clip: {stderr.decode(errors='replace').strip()}")
+        return None
+    return 'h264'
+
+
+def encode_opencv(path, frames, fps, size):
+    """Decode the JPEG frames and write them with OpenCV; returns the FourCC used"""
+    writer = None
+    for fourcc in CLIP_FOURCCS:
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+        if writer.isOpened():
+            break
+        writer.release()
+        writer = None
+    if writer is None:
+        return None
+
+    try:
+        for timestamp, jpeg in frames:
+            frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                continue
+            if (frame.shape[1], frame.shape[0]) != size:
+                frame = cv2.resize(frame, size)
+            writer.write(frame)
+    finally:
+        writer.release()
+    return fourcc
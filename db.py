@@ -1,10 +1,22 @@
 import sqlite3
 import datetime
+import socket
+import json
+import uuid
 import os
 
+# Database file; PPE_DB_PATH lets several instances (e.g. an edge node and the central server) run side by side
+DB_PATH = os.getenv('PPE_DB_PATH', 'ppe_detection.db')
+
+# Queue every new event in the outbox for forwarding to the central instance
+OUTBOX_ENABLED = bool(os.getenv('CENTRAL_INGEST_URL'))
+
+# Address the central instance uses to fetch this site's evidence images and clips
+SITE_BASE_URL = os.getenv('SITE_BASE_URL', f'http://{socket.gethostname()}:3000').rstrip('/')
+
 def init_db():
     """Initialize the database with required tables"""
-    conn = sqlite3.connect('ppe_detection.db')
+    conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     
     # Create table for undetected items
@@ -16,10 +28,57 @@ def init_db():
             hostname TEXT NOT NULL,
             dateandtime DATETIME NOT NULL,
             detectedobject INTEGER NOT NULL,
-            object_name TEXT
+            object_name TEXT,
+            clip_path TEXT,
+            event_id TEXT
         )
     ''')
     
+    # Databases created by older versions lack the newer columns
+    cursor.execute("PRAGMA table_info(undetected_items)")
+    columns = [row[1] for row in cursor.fetchall()]
+    if 'clip_path' not in columns:
+        cursor.execute("ALTER TABLE undetected_items ADD COLUMN clip_path TEXT")
+    if 'event_id' not in columns:
+        cursor.execute("ALTER TABLE undetected_items ADD COLUMN event_id TEXT")
+    
+    # Edge side: events waiting to be forwarded to the central instance.
+    # Keyed by event_id, or '<event_id>:clip' for the update that adds a clip to an event
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            event_id TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            created_at DATETIME NOT NULL
+        )
+    ''')
+    
+    # Edge side: events the central instance rejected as invalid, kept for inspection
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox_dead_letter (
+            event_id TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            created_at DATETIME NOT NULL,
+            failed_at DATETIME NOT NULL,
+            error TEXT
+        )
+    ''')
+    
+    # Central side: events received from every site, deduplicated by event_id
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fleet_events (
+            event_id TEXT PRIMARY KEY,
+            site TEXT NOT NULL,
+            hostname TEXT,
+            dateandtime DATETIME,
+            detectedobject INTEGER,
+            object_name TEXT,
+            filename TEXT,
+            evidence TEXT,
+            received_at DATETIME NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_fleet_events_site ON fleet_events (site, dateandtime)')
+    
     # Create table for detection statistics
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS detection_stats (
@@ -37,7 +96,22 @@ def init_db():
 
 def connect():
     """Create a connection to the database"""
-    return sqlite3.connect('ppe_detection.db', check_same_thread=False)
+    return sqlite3.connect(DB_PATH, check_same_thread=False)
+
+def event_payload(event_id, filename, hostname, dateandtime, detectedobject, object_name, clip=False):
+    """Outbox payload of one event; evidence links are absolute so the central instance can follow them"""
+    evidence = {'image': f'{SITE_BASE_URL}/images/{filename}'}
+    if clip:
+        evidence['clip'] = f'{SITE_BASE_URL}/clips/{filename}'
+    return {
+        'event_id': event_id,
+        'hostname': hostname,
+        'dateandtime': str(dateandtime),
+        'detectedobject': detectedobject,
+        'object_name': object_name,
+        'filename': filename,
+        'evidence': evidence
+    }
 
 def upload_metadata(filename, filepath, hostname, datetime_obj, detectedobject):
     """Upload detection metadata to database"""
@@ -61,10 +135,18 @@ def upload_metadata(filename, filepath, hostname, datetime_obj, detectedobject):
         
         object_name = object_names.get(detectedobject, f'object_{detectedobject}')
         
+        event_id = str(uuid.uuid4())
         cursor.execute('''
-            INSERT INTO undetected_items (filename, filepath, hostname, dateandtime, detectedobject, object_name)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (filename, filepath, hostname, datetime_obj, detectedobject, object_name))
+            INSERT INTO undetected_items (filename, filepath, hostname, dateandtime, detectedobject, object_name, event_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (filename, filepath, hostname, datetime_obj, detectedobject, object_name, event_id))
+        
+        if OUTBOX_ENABLED:
+            # Same transaction as the event itself, so nothing is lost while offline.
+            # The clip is recorded later and forwarded as an update by attach_clip()
+            payload = event_payload(event_id, filename, hostname, datetime_obj, detectedobject, object_name)
+            cursor.execute('INSERT OR IGNORE INTO outbox (event_id, payload, created_at) VALUES (?, ?, ?)',
+                           (event_id, json.dumps(payload), datetime.datetime.now()))
         
         conn.commit()
         conn.close()
@@ -74,6 +156,36 @@ def upload_metadata(filename, filepath, hostname, datetime_obj, detectedobject):
         print(f"Error uploading metadata: {e}")
         return False
 
+def attach_clip(filename, clip_path):
+    """Link an event clip to every detection record of the same screenshot"""
+    try:
+        conn = connect()
+        cursor = conn.cursor()
+        
+        cursor.execute('UPDATE undetected_items SET clip_path = ? WHERE filename = ?', (clip_path, filename))
+        
+        if OUTBOX_ENABLED:
+            # The events themselves may already be forwarded: send the clip as an update of each
+            cursor.execute('''
+                SELECT event_id, hostname, dateandtime, detectedobject, object_name
+                FROM undetected_items WHERE filename = ? AND event_id IS NOT NULL
+            ''', (filename,))
+            now = datetime.datetime.now()
+            rows = [(
+                f'{event_id}:clip',
+                json.dumps(event_payload(event_id, filename, hostname, dateandtime, detectedobject, object_name, clip=True)),
+                now
+            ) for event_id, hostname, dateandtime, detectedobject, object_name in cursor.fetchall()]
+            cursor.executemany('INSERT OR IGNORE INTO outbox (event_id, payload, created_at) VALUES (?, ?, ?)', rows)
+        
+        conn.commit()
+        conn.close()
+        print(f"Clip linked for {filename}: {clip_path}")
+        return True
+    except Exception as e:
+        print(f"Error linking clip: {e}")
+        return False
+
 def get_all_detections():
     """Get all detection records grouped by object type"""
     try:
@@ -197,4 +309,127 @@ def update_detection_stats(total_detections, missing_ppe_count):
         return True
     except Exception as e:
         print(f"Error updating detection stats: {e}")
-        return False
\ No newline at end of file
+        return False
+
+def fetch_outbox(limit=500):
+    """Get the oldest events waiting to be forwarded"""
+    try:
+        conn = connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT event_id, payload FROM outbox ORDER BY created_at LIMIT ?', (limit,))
+        rows = cursor.fetchall()
+        conn.close()
+        return [(event_id, json.loads(payload)) for event_id, payload in rows]
+    except Exception as e:
+        print(f"Error reading outbox: {e}")
+        return []
+
+def delete_outbox(event_ids):
+    """Remove events the central instance has acknowledged"""
+    try:
+        conn = connect()
+        cursor = conn.cursor()
+        cursor.executemany('DELETE FROM outbox WHERE event_id = ?', [(event_id,) for event_id in event_ids])
+        conn.commit()
+        conn.close()
+        return True
+    except Exception as e:
+        print(f"Error deleting from outbox: {e}")
+        return False
+
+def dead_letter_outbox(event_id, payload, error):
+    """Move an event the central instance rejected out of the outbox"""
+    try:
+        conn = connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO outbox_dead_letter (event_id, payload, created_at, failed_at, error)
+            SELECT event_id, payload, created_at, ?, ? FROM outbox WHERE event_id = ?
+        ''', (datetime.datetime.now(), error, event_id))
+        cursor.execute('DELETE FROM outbox WHERE event_id = ?', (event_id,))
+        conn.commit()
+        conn.close()
+        print(f"Outbox event {event_id} dead-lettered: {error}")
+        return True
+    except Exception as e:
+        print(f"Error dead-lettering outbox event: {e}")
+        return False
+
+def count_dead_letters():
+    """Number of events the central instance rejected"""
+    try:
+        conn = connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM outbox_dead_letter')
+        count = cursor.fetchone()[0]
+        conn.close()
+        return count
+    except Exception as e:
+        print(f"Error counting dead letters: {e}")
+        return 0
+
+def count_outbox():
+    """Number of events waiting to be forwarded"""
+    try:
+        conn = connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM outbox')
+        count = cursor.fetchone()[0]
+        conn.close()
+        return count
+    except Exception as e:
+        print(f"Error counting outbox: {e}")
+        return 0
+
+def insert_fleet_events(site, events):
+    """Bulk-insert events from one site; returns how many were new or gained evidence.
+
+    Events are idempotent by event_id: a resent event changes nothing, and an
+    update carrying more evidence (e.g. the clip) is merged into the stored links.
+    """
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        received_at = datetime.datetime.now()
+        rows = [(
+            event['event_id'],
+            site,
+            event.get('hostname'),
+            event.get('dateandtime'),
+            event.get('detectedobject'),
+            event.get('object_name'),
+            event.get('filename'),
+            json.dumps(event.get('evidence') or {}),
+            received_at
+        ) for event in events]
+        before = conn.total_changes
+        cursor.executemany('''
+            INSERT INTO fleet_events
+                (event_id, site, hostname, dateandtime, detectedobject, object_name, filename, evidence, received_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (event_id) DO UPDATE SET evidence = json_patch(fleet_events.evidence, excluded.evidence)
+            WHERE json_patch(fleet_events.evidence, excluded.evidence) != json(fleet_events.evidence)
+        ''', rows)
+        conn.commit()
+        return conn.total_changes - before
+    finally:
+        conn.close()
+
+def get_fleet_summary():
+    """Per-site event counts and latest event time"""
+    try:
+        conn = connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT site, COUNT(*), MAX(dateandtime), MAX(received_at)
+            FROM fleet_events GROUP BY site ORDER BY site
+        ''')
+        rows = cursor.fetchall()
+        conn.close()
+        return [
+            {'site': site, 'events': count, 'last_event': last_event, 'last_received': last_received}
+            for site, count, last_event, last_received in rows
+        ]
+    except Exception as e:
+        print(f"Error getting fleet summary: {e}")
+        return []
@@ -0,0 +1,58 @@
+import cv2
+import numpy as np
+
+# Compact detection layout: one float32 row per box
+# [x1, y1, x2, y2, confidence, class_id, track_id]  (track_id is -1 when untracked)
+DETECTION_COLUMNS = 7
+
+
+def empty():
+    """Return an empty detection array"""
+    return np.zeros((0, DETECTION_COLUMNS), dtype=np.float32)
+
+
+def to_array(result):
+    """Convert one ultralytics Results object into a compact Nx7 float32 array"""
+    boxes = result.boxes if result is not None else None
+    if boxes is None or len(boxes) == 0:
+        return empty()
+
+    dets = np.empty((len(boxes), DETECTION_COLUMNS), dtype=np.float32)
+    dets[:, 0:4] = boxes.xyxy.cpu().numpy()
+    dets[:, 4] = boxes.conf.cpu().numpy()
+    dets[:, 5] = boxes.cls.cpu().numpy()
+    if boxes.id is not None:
+        dets[:, 6] = boxes.id.cpu().numpy()
+    else:
+        dets[:, 6] = -1
+    return dets
+
+
+def class_ids(dets):
+    """Return the class ids of a detection array"""
+    return dets[:, 5].copy()
+
+
+def draw(frame, dets, names=None, labels=True):
+    """Draw detection boxes (and optionally labels) onto frame in place"""
+    for x1, y1, x2, y2, conf, cls, track_id in dets:
+        cls = int(cls)
+        color = COLORS[cls % len(COLORS)]
+        p1, p2 = (int(x1), int(y1)), (int(x2), int(y2))
+        cv2.rectangle(frame, p1, p2, color, 2)
+        if labels:
+            label = names.get(cls, str(cls)) if names else str(cls)
+            if track_id >= 0:
+                label = f"#{int(track_id)} {label}"
+            label = f"{label} {conf:.2f}"
+            cv2.putText(frame, label, (p1[0], max(p1[1] - 6, 12)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+    return frame
+
+
+# BGR palette for box colors, indexed by class id
+COLORS = [
+    (56, 56, 255), (151, 157, 255), (31, 112, 255), (29, 178, 255),
+    (49, 210, 207), (10, 249, 72), (23, 204, 146), (134, 219, 61),
+    (211, 188, 0), (209, 99, 0), (255, 194, 0), (147, 69, 52),
+    (255, 115, 100), (236, 24, 0), (255, 56, 132), (133, 0, 82),
+]
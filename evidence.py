@@ -0,0 +1,76 @@
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import cv2
+import os
+
+# Evidence images are kept in EVIDENCE_DIR as <name>.jpg plus smaller renditions
+# (<name>_thumb.jpg, <name>_medium.jpg) generated in a worker pool when stored
+EVIDENCE_DIR = os.path.abspath(os.getenv('EVIDENCE_DIR', 'evidence'))
+EVIDENCE_WORKERS = int(os.getenv('EVIDENCE_WORKERS', '2'))
+
+# Rendition name -> (max width, JPEG quality)
+RENDITIONS = {
+    'thumb': (320, 75),
+    'medium': (960, 85),
+}
+
+rendition_pool = ThreadPoolExecutor(max_workers=EVIDENCE_WORKERS, thread_name_prefix='evidence')
+
+
+def image_name(name, size='full'):
+    """File name of an evidence image rendition"""
+    return f'{name}.jpg' if size == 'full' else f'{name}_{size}.jpg'
+
+
+def write_rendition(image, name, size):
+    """Downscale image to a rendition and write it atomically"""
+    max_width, quality = RENDITIONS[size]
+    height, width = image.shape[:2]
+    if width > max_width:
+        image = cv2.resize(image, (max_width, int(height * max_width / width)), interpolation=cv2.INTER_AREA)
+
+    path = os.path.join(EVIDENCE_DIR, image_name(name, size))
+    # A unique temp file per writer: the worker pool and an on-demand request may
+    # write the same rendition at once. Keep .jpg last so OpenCV picks the JPEG encoder
+    fd, tmp_path = tempfile.mkstemp(dir=EVIDENCE_DIR, prefix=f'.{name}_{size}.', suffix='.jpg')
+    os.close(fd)
+    try:
+        if not cv2.imwrite(tmp_path, image, [int(cv2.IMWRITE_JPEG_QUALITY), quality]):
+            print(f"Error writing rendition {path}")
+            return None
+        # mkstemp creates the file owner-only; renditions are as readable as the original
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def generate_renditions(image, name):
+    """Write every rendition of an evidence image"""
+    try:
+        for size in RENDITIONS:
+            write_rendition(image, name, size)
+        print(f"Renditions generated for {name}")
+    except Exception as e:
+        print(f"Error generating renditions for {name}: {e}")
+
+
+def submit_renditions(image, name):
+    """Generate renditions in the worker pool; image must not be modified afterwards"""
+    return rendition_pool.submit(generate_renditions, image, name)
+
+
+def rendition_path(name, size):
+    """Path of a rendition, generating it on demand for evidence stored before renditions existed"""
+    path = os.path.join(EVIDENCE_DIR, image_name(name, size))
+    if size == 'full' or os.path.exists(path):
+        return path
+    original = os.path.join(EVIDENCE_DIR, image_name(name))
+    if not os.path.exists(original):
+        return path
+    image = cv2.imread(original)
+    if image is None:
+        return path
+    return write_rendition(image, name, size) or path
@@ -0,0 +1,223 @@
+from flask import Blueprint, Flask, request, jsonify
+from dotenv import load_dotenv
+import urllib.request
+import urllib.error
+import threading
+import argparse
+import random
+import socket
+import json
+import gzip
+import zlib
+import db
+import os
+
+load_dotenv()
+
+# Edge side: events are stored in the local outbox and forwarded in gzip-compressed batches
+CENTRAL_INGEST_URL = os.getenv('CENTRAL_INGEST_URL', '')  # e.g. http://central:3000
+SITE_ID = os.getenv('SITE_ID', socket.gethostname())
+INGEST_TOKEN = os.getenv('INGEST_TOKEN', '')
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '500'))
+INGEST_INTERVAL = float(os.getenv('INGEST_INTERVAL', '5'))
+
+# Central side: only instances with INGEST_SERVER=1 (or started via `python ingest.py`)
+# accept events; batches that decompress to more than this are rejected
+INGEST_SERVER = os.getenv('INGEST_SERVER', '0') == '1'
+MAX_BATCH_BYTES = int(os.getenv('INGEST_MAX_BATCH_BYTES', str(16 * 1024 * 1024)))
+
+# Other 4xx replies fail the same way on every retry: the batch is split and bad events dead-lettered.
+# These are retried instead: auth, rate limiting, and a wrong or unreachable endpoint
+RETRY_STATUSES = {401, 403, 404, 408, 429}
+
+ingest_api = Blueprint('ingest_api', __name__)
+
+
+def authorized():
+    return not INGEST_TOKEN or request.headers.get('Authorization') == f'Bearer {INGEST_TOKEN}'
+
+
+class BatchTooLarge(ValueError):
+    pass
+
+
+def read_body():
+    """Request body, gunzipped when sent with Content-Encoding: gzip"""
+    body = request.get_data(cache=False)
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        body = decompressor.decompress(body, MAX_BATCH_BYTES + 1)
+    if len(body) > MAX_BATCH_BYTES:
+        raise BatchTooLarge(f'batch larger than {MAX_BATCH_BYTES} bytes')
+    return body
+
+
+@ingest_api.route('/api/ingest/events', methods=['POST'])
+def ingest_events():
+    """Accept a batch of events from one site; idempotent by event_id"""
+    if not authorized():
+        return jsonify({"success": False, "error": "unauthorized"}), 401
+    try:
+        body = read_body()
+    except BatchTooLarge as e:
+        return jsonify({"success": False, "error": str(e)}), 413
+    except Exception as e:
+        return jsonify({"success": False, "error": f"invalid batch: {e}"}), 400
+
+    try:
+        batch = json.loads(body)
+        site = str(batch['site'])
+        events = batch['events']
+        for event in events:
+            if not isinstance(event, dict) or not isinstance(event.get('event_id'), str) or not event['event_id']:
+                raise ValueError('every event needs a string event_id')
+    except Exception as e:
+        return jsonify({"success": False, "error": f"invalid batch: {e}"}), 400
+
+    try:
+        inserted = db.insert_fleet_events(site, events)
+    except Exception as e:
+        print(f"Error ingesting batch from {site}: {e}")
+        return jsonify({"success": False, "error": "storage error"}), 503
+
+    return jsonify({
+        "success": True,
+        "accepted": len(events),
+        "inserted": inserted,
+        "duplicates": len(events) - inserted
+    })
+
+
+@ingest_api.route('/api/ingest/sites')
+def ingest_sites():
+    """Fleet-wide view: event counts per reporting site"""
+    if not authorized():
+        return jsonify({"success": False, "error": "unauthorized"}), 401
+    return jsonify({"sites": db.get_fleet_summary()})
+
+
+class OutboxForwarder:
+    """Background thread that drains the local outbox to the central instance.
+
+    Events are acknowledged (deleted from the outbox) only after the central
+    side accepted the batch; failures back off exponentially with jitter.
+    A batch the central side rejects as invalid is split in half until the
+    offending events are isolated and moved to the dead-letter table, so one
+    bad event cannot block the outbox.
+    """
+
+    def __init__(self, url=CENTRAL_INGEST_URL, site=SITE_ID, token=INGEST_TOKEN,
+                 batch_size=INGEST_BATCH_SIZE, interval=INGEST_INTERVAL, backoff_max=300.0):
+        self.url = url.rstrip('/') + '/api/ingest/events'
+        self.site = site
+        self.token = token
+        self.batch_size = batch_size
+        self.interval = interval
+        self.backoff_max = backoff_max
+        self.backoff = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stats = {'sent': 0, 'batches': 0, 'failures': 0, 'dead_lettered': 0, 'last_error': None}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='outbox-forwarder', daemon=True)
+        self.thread.start()
+        print(f"Outbox forwarder started: {self.site} -> {self.url}")
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            pending = db.fetch_outbox(self.batch_size)
+            if not pending:
+                self.stop_event.wait(self.interval)
+                continue
+
+            try:
+                self.forward(pending)
+            except Exception as e:
+                self.stats['failures'] += 1
+                self.stats['last_error'] = str(e)
+                # Full jitter keeps a fleet of edge nodes from retrying in lockstep
+                delay = random.uniform(self.backoff / 2, self.backoff)
+                print(f"Outbox forward failed ({e}), retrying in {delay:.1f}s")
+                self.backoff = min(self.backoff * 2, self.backoff_max)
+                self.stop_event.wait(delay)
+                continue
+
+            self.backoff = self.interval
+            if len(pending) < self.batch_size:
+                # Caught up; batch whatever accumulates during the next interval
+                self.stop_event.wait(self.interval)
+
+    def forward(self, pending):
+        """Send (outbox key, payload) pairs; transient failures raise and leave the rest queued"""
+        try:
+            self.send([payload for event_id, payload in pending])
+        except urllib.error.HTTPError as e:
+            if not 400 <= e.code < 500 or e.code in RETRY_STATUSES:
+                raise
+            error = rejection_message(e)
+            if len(pending) == 1:
+                event_id, payload = pending[0]
+                db.dead_letter_outbox(event_id, json.dumps(payload), error)
+                self.stats['dead_lettered'] += 1
+                return
+            print(f"Central rejected a batch of {len(pending)} ({error}), splitting it")
+            middle = len(pending) // 2
+            self.forward(pending[:middle])
+            self.forward(pending[middle:])
+            return
+
+        db.delete_outbox([event_id for event_id, payload in pending])
+        self.stats['sent'] += len(pending)
+        self.stats['batches'] += 1
+
+    def send(self, events):
+        body = gzip.compress(json.dumps({'site': self.site, 'events': events}).encode('utf-8'))
+        headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        req = urllib.request.Request(self.url, data=body, headers=headers, method='POST')
+        with urllib.request.urlopen(req, timeout=30) as response:
+            result = json.loads(response.read())
+        if not result.get('success'):
+            raise RuntimeError(result.get('error', 'rejected'))
+        return result
+
+    def status(self):
+        status = dict(self.stats)
+        status['pending'] = db.count_outbox()
+        status['dead_letters'] = db.count_dead_letters()
+        status['site'] = self.site
+        return status
+
+
+def rejection_message(error):
+    """Error message from a rejected batch response"""
+    try:
+        return f"{error.code}: {json.loads(error.read()).get('error')}"
+    except Exception:
+        return f"{error.code}: {error.reason}"
+
+
+def create_central_app():
+    """Standalone central instance that only serves the ingestion API"""
+    central = Flask(__name__)
+    central.register_blueprint(ingest_api)
+    return central
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a central event ingestion server')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=3100)
+    parser.add_argument('--db', default=os.getenv('PPE_DB_PATH', 'central.db'), help='database file for fleet events')
+    args = parser.parse_args()
+
+    db.DB_PATH = args.db
+    db.init_db()
+    if not INGEST_TOKEN:
+        print("Warning: INGEST_TOKEN is not set, any client can post events")
+    create_central_app().run(host=args.host, port=args.port, threaded=True)
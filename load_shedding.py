@@ -0,0 +1,322 @@
+import collections
+import threading
+import datetime
+import json
+import time
+import os
+
+# Degradation ladders per stream priority. Level 0 is full quality; each step
+# sheds more work. Critical streams keep full-rate detection at every level and
+# only give up output quality.
+LADDERS = {
+    'critical': [
+        dict(stride=1, imgsz=640, fps=30, jpeg_quality=90, annotate=True),
+        dict(stride=1, imgsz=640, fps=30, jpeg_quality=75, annotate=True),
+        dict(stride=1, imgsz=640, fps=20, jpeg_quality=65, annotate=True),
+    ],
+    'normal': [
+        dict(stride=1, imgsz=640, fps=30, jpeg_quality=90, annotate=True),
+        dict(stride=2, imgsz=640, fps=30, jpeg_quality=80, annotate=True),
+        dict(stride=3, imgsz=512, fps=20, jpeg_quality=70, annotate=True),
+        dict(stride=6, imgsz=416, fps=15, jpeg_quality=60, annotate=True),
+    ],
+    'low': [
+        dict(stride=1, imgsz=640, fps=30, jpeg_quality=90, annotate=True),
+        dict(stride=2, imgsz=512, fps=20, jpeg_quality=75, annotate=True),
+        dict(stride=4, imgsz=416, fps=15, jpeg_quality=65, annotate=True),
+        dict(stride=8, imgsz=320, fps=10, jpeg_quality=55, annotate=False),
+        dict(stride=12, imgsz=320, fps=5, jpeg_quality=50, annotate=False),
+    ],
+}
+
+# Lower rank = more important; the controller sheds load from the highest rank first
+PRIORITY_RANK = {'critical': 0, 'normal': 1, 'low': 2}
+
+# Frames a stream must report after a change before it is judged again
+MIN_SAMPLES = 5
+
+# Seconds without reports after which a stream (e.g. a closed viewer or a
+# replaced source) no longer takes part in decisions
+IDLE_TIMEOUT = 10.0
+
+LOAD_SHEDDING_LOG = os.getenv('LOAD_SHEDDING_LOG', 'load_shedding.jsonl')
+
+
+def parse_priorities(value):
+    """Parse 'source=priority,source=priority' (e.g. STREAM_PRIORITIES) into a dict"""
+    priorities = {}
+    for item in value.split(','):
+        source, _, priority = item.strip().rpartition('=')
+        if source and priority in LADDERS:
+            priorities[source] = priority
+    return priorities
+
+
+class StreamState:
+    """Smoothed load metrics and the current degradation level of one stream.
+
+    'latency' streams are processed one frame at a time, so a frame taking
+    longer than the frame budget means the stream falls behind. 'throughput'
+    streams are processed by parallel workers, where per-frame latency can
+    exceed the budget while the workers keep up; they are judged by the rate
+    of processed frames against the rate the source delivers at the current
+    stride instead.
+    """
+
+    def __init__(self, name, priority, source_fps, metric='latency'):
+        self.name = name
+        self.priority = priority
+        self.source_fps = source_fps or 30
+        self.metric = metric
+        self.level = 0
+        self.latency = 0.0      # EWMA of per-frame processing time (seconds)
+        self.interval = 0.0     # EWMA of time between processed frames (seconds)
+        self.queue_depth = 0
+        self.samples = 0
+        self.last_report = time.time()
+        self.changed_at = 0.0   # time of the last level change
+
+    def knobs(self):
+        knobs = dict(LADDERS[self.priority][self.level])
+        knobs['fps'] = min(knobs['fps'], self.source_fps)
+        return knobs
+
+    def budget(self, level=None):
+        """Time available per processed frame to keep up with the output rate"""
+        ladder = LADDERS[self.priority]
+        knobs = ladder[self.level if level is None else level]
+        return 1.0 / min(knobs['fps'], self.source_fps)
+
+    def expected_rate(self):
+        """Processed frames per second needed to keep up with the source; every frame is
+        encoded, the stride only skips detection"""
+        return self.source_fps
+
+    def rate(self):
+        return 1.0 / self.interval if self.interval > 0 else 0.0
+
+    def settled(self):
+        """Enough frames were measured since the last change to judge this level"""
+        return self.samples >= MIN_SAMPLES
+
+    def cooling_down(self, now, cooldown):
+        """The last change is too recent for its effect to show in the measurements"""
+        return now - self.changed_at < cooldown
+
+    def idle(self, now, timeout=IDLE_TIMEOUT):
+        return now - self.last_report > timeout
+
+    def behind(self, utilization):
+        if not self.settled():
+            return False
+        if self.metric == 'throughput':
+            return self.rate() < self.expected_rate() * utilization
+        return self.latency > self.budget() * utilization
+
+    def has_headroom(self, utilization):
+        """The stream would still keep up one level better"""
+        if self.metric == 'throughput':
+            # Keeping up with an empty queue; a smaller stride is then tried and undone if it falls behind
+            return not self.behind(utilization) and self.queue_depth <= 1
+        return self.latency < self.budget(self.level - 1) * utilization * 0.7
+
+    def can_degrade(self):
+        return self.level < len(LADDERS[self.priority]) - 1
+
+
+class LoadShedController:
+    """Adjusts per-stream detection stride, imgsz, output FPS, JPEG quality and
+    annotation based on per-stream latency, queue depth and CPU load.
+
+    Streams report each processed frame; every `interval` seconds at most one
+    stream is stepped down (when overloaded) or back up (when there is headroom).
+    Streams that stopped reporting for `idle_timeout` seconds are left out, and
+    a stream is not changed again within `cooldown` seconds of its last change.
+    CPU load is the utilization measured since the previous evaluation, so it
+    reflects the settings the controller chose last.
+    Every decision is printed, kept in memory and appended to a JSON-lines log.
+    """
+
+    def __init__(self, interval=2.0, utilization=0.85, cpu_high=0.9, cpu_low=0.6,
+                 max_queue_depth=8, alpha=0.2, idle_timeout=IDLE_TIMEOUT, cooldown=None,
+                 log_path=LOAD_SHEDDING_LOG):
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.cooldown = 3 * interval if cooldown is None else cooldown
+        self.utilization = utilization
+        self.cpu_high = cpu_high
+        self.cpu_low = cpu_low
+        self.max_queue_depth = max_queue_depth
+        self.alpha = alpha
+        self.log_path = log_path
+        self.streams = {}
+        self.decisions = collections.deque(maxlen=200)
+        self.last_evaluation = time.time()
+        self.lock = threading.Lock()
+        self.cpu_times = None
+        self.cpu = 0.0
+        self.cpu_load()  # first /proc/stat sample; utilization is measured from here
+
+    def register(self, name, priority='normal', source_fps=30, metric='latency'):
+        with self.lock:
+            if name not in self.streams:
+                self.streams[name] = StreamState(name, priority if priority in LADDERS else 'normal',
+                                                 source_fps, metric)
+            return self.streams[name].knobs()
+
+    def unregister(self, name):
+        with self.lock:
+            self.streams.pop(name, None)
+
+    def knobs(self, name):
+        with self.lock:
+            state = self.streams.get(name)
+            return state.knobs() if state else dict(LADDERS['normal'][0])
+
+    def report(self, name, latency, queue_depth=0):
+        """Record one processed frame and re-evaluate if the interval has elapsed"""
+        with self.lock:
+            state = self.streams.get(name)
+            if state is None:
+                return
+            now = time.time()
+            if state.idle(now, self.idle_timeout):
+                # Measurements from before the pause say nothing about now
+                state.samples = 0
+            if state.samples == 0:
+                state.latency = latency
+                state.interval = 0.0
+            else:
+                state.latency += self.alpha * (latency - state.latency)
+                elapsed = now - state.last_report
+                state.interval = elapsed if state.interval == 0 else state.interval + self.alpha * (elapsed - state.interval)
+            state.last_report = now
+            state.queue_depth = queue_depth
+            state.samples += 1
+            due = now - self.last_evaluation >= self.interval
+        if due:
+            self.evaluate()
+
+    def cpu_load(self):
+        """CPU utilization (0-1) since the previous call, from /proc/stat.
+
+        Falls back to the 1-minute load average normalized by core count where
+        /proc/stat is unavailable (0 where neither is supported).
+        """
+        try:
+            with open('/proc/stat') as f:
+                fields = [int(value) for value in f.readline().split()[1:9]]
+            idle = fields[3] + fields[4]  # idle + iowait
+            total = sum(fields)
+            previous, self.cpu_times = self.cpu_times, (idle, total)
+            if previous is not None and total > previous[1]:
+                self.cpu = 1.0 - (idle - previous[0]) / (total - previous[1])
+            return self.cpu
+        except (OSError, ValueError, IndexError):
+            pass
+        try:
+            self.cpu = os.getloadavg()[0] / (os.cpu_count() or 1)
+        except (AttributeError, OSError):
+            self.cpu = 0.0
+        return self.cpu
+
+    def evaluate(self):
+        """Step one stream down or up based on the current load"""
+        with self.lock:
+            self.last_evaluation = time.time()
+            states = [s for s in self.streams.values() if not s.idle(self.last_evaluation, self.idle_timeout)]
+            if not states:
+                return None
+            cpu = self.cpu_load()
+            behind = [s for s in states if s.behind(self.utilization)]
+            congested = [s for s in states if s.queue_depth > self.max_queue_depth]
+
+            if behind or congested or cpu > self.cpu_high:
+                # Shed from the least important, least degraded stream first
+                candidates = [s for s in states if s.can_degrade()]
+                if not candidates:
+                    return None
+                target = max(candidates, key=lambda s: (PRIORITY_RANK[s.priority], -s.level))
+                if not target.settled() or target.cooling_down(self.last_evaluation, self.cooldown):
+                    # Wait for the last change to show instead of shedding a more important stream
+                    return None
+                reason = self._reason(cpu, behind, congested)
+                decision = self._apply(target, target.level + 1, 'degrade', reason, cpu)
+            elif cpu < self.cpu_low and all(s.settled() for s in states):
+                # Restore the most important stream that would still keep up at the better level
+                candidates = [s for s in states if s.level > 0 and s.has_headroom(self.utilization)
+                              and not s.cooling_down(self.last_evaluation, self.cooldown)]
+                if not candidates:
+                    return None
+                target = min(candidates, key=lambda s: (PRIORITY_RANK[s.priority], -s.level))
+                decision = self._apply(target, target.level - 1, 'restore', 'headroom', cpu)
+            else:
+                return None
+
+        self._log(decision)
+        return decision
+
+    def _reason(self, cpu, behind, congested):
+        reasons = []
+        if behind:
+            reasons.append('behind: ' + ','.join(s.name for s in behind))
+        if congested:
+            reasons.append('queue: ' + ','.join(s.name for s in congested))
+        if cpu > self.cpu_high:
+            reasons.append(f'cpu {cpu:.2f}')
+        return '; '.join(reasons)
+
+    def _apply(self, state, level, action, reason, cpu):
+        previous = state.level
+        state.level = level
+        state.changed_at = time.time()
+        # Old samples describe the previous settings
+        state.samples = 0
+        decision = {
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'stream': state.name,
+            'priority': state.priority,
+            'action': action,
+            'from_level': previous,
+            'to_level': level,
+            'knobs': state.knobs(),
+            'reason': reason,
+            'latency_ms': round(state.latency * 1000, 1),
+            'rate': round(state.rate(), 1),
+            'queue_depth': state.queue_depth,
+            'cpu_load': round(cpu, 2)
+        }
+        self.decisions.append(decision)
+        return decision
+
+    def _log(self, decision):
+        print(f"Load shedding: {decision['action']} {decision['stream']} "
+              f"{decision['from_level']}->{decision['to_level']} ({decision['reason']})")
+        if not self.log_path:
+            return
+        try:
+            with open(self.log_path, 'a') as f:
+                f.write(json.dumps(decision) + '\n')
+        except Exception as e:
+            print(f"Error writing load shedding log: {e}")
+
+    def status(self):
+        with self.lock:
+            now = time.time()
+            return {
+                'cpu_load': round(self.cpu, 2),
+                'streams': {
+                    name: {
+                        'priority': s.priority,
+                        'metric': s.metric,
+                        'level': s.level,
+                        'idle': s.idle(now, self.idle_timeout),
+                        'latency_ms': round(s.latency * 1000, 1),
+                        'rate': round(s.rate(), 1),
+                        'expected_rate': round(s.expected_rate(), 1),
+                        'queue_depth': s.queue_depth,
+                        'knobs': s.knobs()
+                    } for name, s in self.streams.items()
+                },
+                'decisions': list(self.decisions)[-20:]
+            }
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Load generator for the PPE detection web server.
+
+Simulates MJPEG viewers of /video_feed (per-client delivered FPS and frame age),
+dashboard pollers of /logs, /updates and /camera_status, /switch_camera callers
+and /detections event-stream subscribers, then prints a capacity report.
+
+    python app.py                      # in another terminal
+    python loadtest.py --viewers 20 --pollers 5 --subscribers 5 --duration 60 --source test_video.mp4
+"""
+
+from urllib.parse import urlsplit
+import http.client
+import statistics
+import math
+import threading
+import argparse
+import random
+import json
+import time
+import sys
+
+DASHBOARD_PATHS = ['/logs', '/updates', '/camera_status']
+# /detections sends a keepalive every 15 s while idle; subscribers must wait longer than that
+SUBSCRIBER_TIMEOUT = 30
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(values, scale=1.0, digits=1):
+    """p50/p90/p99/max of a list, scaled (e.g. seconds -> ms)"""
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'p50': round(percentile(values, 50) * scale, digits),
+        'p90': round(percentile(values, 90) * scale, digits),
+        'p99': round(percentile(values, 99) * scale, digits),
+        'max': round(max(values) * scale, digits)
+    }
+
+
+class LoadTest:
+    def __init__(self, base_url, duration, warmup=2.0, stall_seconds=1.0):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.duration = duration
+        self.warmup = warmup
+        self.stall_seconds = stall_seconds
+        self.lock = threading.Lock()
+        self.viewers = []
+        self.requests = {}
+        self.subscribers = []
+        self.errors = []
+        self.started = None
+        self.deadline = None
+
+    def connection(self, timeout=10):
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def measuring(self):
+        return time.time() >= self.started + self.warmup
+
+    def record_request(self, name, latency, status):
+        with self.lock:
+            entry = self.requests.setdefault(name, {'latencies': [], 'errors': 0, 'statuses': {}})
+            entry['statuses'][status] = entry['statuses'].get(status, 0) + 1
+            if isinstance(status, int) and status < 400:
+                entry['latencies'].append(latency)
+            else:
+                entry['errors'] += 1
+
+    def record_error(self, kind, error):
+        with self.lock:
+            self.errors.append(f'{kind}: {error}')
+
+    def viewer(self, index, path):
+        """One MJPEG client: reads every part and records arrival time and frame age"""
+        stats = {'frames': 0, 'bytes': 0, 'ages': [], 'gaps': [], 'stalls': 0, 'first_frame': None}
+        with self.lock:
+            self.viewers.append(stats)
+        try:
+            conn = self.connection()
+            request_start = time.time()
+            conn.request('GET', path)
+            response = conn.getresponse()
+            if response.status != 200:
+                raise RuntimeError(f'HTTP {response.status}')
+
+            last_arrival = None
+            while time.time() < self.deadline:
+                headers = self.read_part_headers(response)
+                if headers is None:
+                    break
+                length = int(headers.get('content-length', 0))
+                if not length:
+                    raise RuntimeError('multipart part without Content-Length')
+                response.read(length)
+                now = time.time()
+
+                if stats['first_frame'] is None:
+                    stats['first_frame'] = now - request_start
+                if not self.measuring():
+                    last_arrival = now
+                    continue
+                stats['frames'] += 1
+                stats['bytes'] += length
+                if 'x-frame-timestamp' in headers:
+                    stats['ages'].append(now - float(headers['x-frame-timestamp']))
+                if last_arrival is not None:
+                    gap = now - last_arrival
+                    stats['gaps'].append(gap)
+                    if gap > self.stall_seconds:
+                        stats['stalls'] += 1
+                last_arrival = now
+            conn.close()
+        except Exception as e:
+            self.record_error(f'viewer {index}', e)
+
+    def read_part_headers(self, response):
+        """Skip to the next '--frame' boundary and return the part headers (lower-cased)"""
+        while True:
+            line = response.readline()
+            if not line:
+                return None
+            if line.strip() == b'--frame':
+                break
+        headers = {}
+        while True:
+            line = response.readline()
+            if not line:
+                return None
+            line = line.strip()
+            if not line:
+                return headers
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+    def poller(self, index, interval):
+        """Dashboard client polling the history and status pages"""
+        conn = self.connection()
+        while time.time() < self.deadline:
+            path = random.choice(DASHBOARD_PATHS)
+            start = time.time()
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except Exception as e:
+                conn.close()
+                conn = self.connection()
+                status = type(e).__name__
+            if self.measuring():
+                self.record_request(path, time.time() - start, status)
+            time.sleep(interval)
+        conn.close()
+
+    def switcher(self, index, interval, sources):
+        """Client that keeps switching the video source"""
+        conn = self.connection(timeout=30)
+        while time.time() < self.deadline:
+            body = json.dumps({'source': random.choice(sources)})
+            start = time.time()
+            try:
+                conn.request('POST', '/switch_camera', body=body, headers={'Content-Type': 'application/json'})
+                response = conn.getresponse()
+                result = json.loads(response.read() or b'{}')
+                status = response.status if result.get('success') else 'failed'
+            except Exception as e:
+                conn.close()
+                conn = self.connection(timeout=30)
+                status = type(e).__name__
+            if self.measuring():
+                self.record_request('/switch_camera', time.time() - start, status)
+            time.sleep(interval)
+        conn.close()
+
+    def subscriber(self, index):
+        """Server-sent events client of /detections"""
+        stats = {'events': 0, 'first_event': None}
+        with self.lock:
+            self.subscribers.append(stats)
+        try:
+            conn = self.connection(timeout=SUBSCRIBER_TIMEOUT)
+            start = time.time()
+            conn.request('GET', f'/detections?client=loadtest-{index}')
+            response = conn.getresponse()
+            if response.status != 200:
+                raise RuntimeError(f'HTTP {response.status}')
+            while time.time() < self.deadline:
+                line = response.readline()
+                if not line:
+                    break
+                if line.startswith(b'data:'):
+                    if stats['first_event'] is None:
+                        stats['first_event'] = time.time() - start
+                    if self.measuring():
+                        stats['events'] += 1
+            conn.close()
+        except Exception as e:
+            self.record_error(f'subscriber {index}', e)
+
+    def prepare(self, source, wait_ready):
+        """Select the video source and optionally wait for /readyz"""
+        if wait_ready:
+            deadline = time.time() + wait_ready
+            while time.time() < deadline:
+                try:
+                    conn = self.connection()
+                    conn.request('GET', '/readyz')
+                    if conn.getresponse().status == 200:
+                        break
+                except Exception:
+                    pass
+                time.sleep(0.5)
+            else:
+                print('Warning: server did not become ready, continuing anyway')
+        if source:
+            conn = self.connection(timeout=30)
+            conn.request('POST', '/switch_camera', body=json.dumps({'source': source}),
+                         headers={'Content-Type': 'application/json'})
+            result = json.loads(conn.getresponse().read() or b'{}')
+            if not result.get('success'):
+                print(f"Warning: could not switch to {source}: {result.get('error')}")
+
+    def run(self, viewers=0, viewer_path='/video_feed', pollers=0, poll_interval=1.0,
+            switchers=0, switch_interval=10.0, switch_sources=('demo', 'test_video.mp4'), subscribers=0):
+        self.started = time.time()
+        self.deadline = self.started + self.warmup + self.duration
+        threads = []
+        for i in range(viewers):
+            # Overlay viewers need their own client id so they can pair with a subscriber
+            path = viewer_path.replace('{client}', f'loadtest-{i}')
+            threads.append(threading.Thread(target=self.viewer, args=(i, path), daemon=True))
+        for i in range(pollers):
+            threads.append(threading.Thread(target=self.poller, args=(i, poll_interval), daemon=True))
+        for i in range(switchers):
+            threads.append(threading.Thread(target=self.switcher, args=(i, switch_interval, list(switch_sources)), daemon=True))
+        for i in range(subscribers):
+            threads.append(threading.Thread(target=self.subscriber, args=(i,), daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=max(0, self.deadline - time.time()) + SUBSCRIBER_TIMEOUT)
+        return self.report()
+
+    def report(self):
+        with self.lock:
+            viewer_fps = [v['frames'] / self.duration for v in self.viewers]
+            ages = [age for v in self.viewers for age in v['ages']]
+            gaps = [gap for v in self.viewers for gap in v['gaps']]
+            first_frames = [v['first_frame'] for v in self.viewers if v['first_frame'] is not None]
+            return {
+                'duration': self.duration,
+                'viewers': {
+                    'clients': len(self.viewers),
+                    'connected': len(first_frames),
+                    'fps': {
+                        'min': round(min(viewer_fps), 2) if viewer_fps else None,
+                        'median': round(statistics.median(viewer_fps), 2) if viewer_fps else None,
+                        'total': round(sum(viewer_fps), 2)
+                    },
+                    'throughput_mbps': round(sum(v['bytes'] for v in self.viewers) * 8 / self.duration / 1e6, 2),
+                    'frame_age_ms': summarize(ages, 1000),
+                    'frame_gap_ms': summarize(gaps, 1000),
+                    'time_to_first_frame_ms': summarize(first_frames, 1000),
+                    'stalls': sum(v['stalls'] for v in self.viewers)
+                },
+                'requests': {
+                    name: dict(summarize(entry['latencies'], 1000), errors=entry['errors'], statuses=entry['statuses'])
+                    for name, entry in sorted(self.requests.items())
+                },
+                'subscribers': {
+                    'clients': len(self.subscribers),
+                    'events_per_second': round(sum(s['events'] for s in self.subscribers) / self.duration, 2),
+                    'time_to_first_event_ms': summarize(
+                        [s['first_event'] for s in self.subscribers if s['first_event'] is not None], 1000)
+                },
+                'errors': list(self.errors)
+            }
+
+
+def print_report(report):
+    viewers = report['viewers']
+    print(f"\n=== Capacity report ({report['duration']:.0f}s) ===")
+    if viewers['clients']:
+        print(f"MJPEG viewers: {viewers['connected']}/{viewers['clients']} connected, "
+              f"{viewers['stalls']} stalls, {viewers['throughput_mbps']} Mbit/s")
+        print(f"  per-client FPS  min {viewers['fps']['min']}  median {viewers['fps']['median']}  total {viewers['fps']['total']}")
+        for label, key in (('frame age', 'frame_age_ms'), ('frame gap', 'frame_gap_ms'), ('first frame', 'time_to_first_frame_ms')):
+            stats = viewers[key]
+            if stats['count']:
+                print(f"  {label:<11} p50 {stats['p50']}ms  p90 {stats['p90']}ms  p99 {stats['p99']}ms  max {stats['max']}ms")
+    for name, stats in report['requests'].items():
+        if stats['count']:
+            print(f"{name:<15} n={stats['count']:<6} p50 {stats['p50']}ms  p90 {stats['p90']}ms  "
+                  f"p99 {stats['p99']}ms  max {stats['max']}ms  errors {stats['errors']}")
+        else:
+            print(f"{name:<15} errors {stats['errors']} {stats['statuses']}")
+    subscribers = report['subscribers']
+    if subscribers['clients']:
+        print(f"Event streams: {subscribers['clients']} clients, {subscribers['events_per_second']} events/s")
+    if report['errors']:
+        print(f"Errors ({len(report['errors'])}):")
+        for error in report['errors'][:10]:
+            print(f"  {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the PPE detection web server')
+    parser.add_argument('--url', default='http://127.0.0.1:3000', help='server base URL')
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds (after warm-up)')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds excluded from the statistics')
+    parser.add_argument('--viewers', type=int, default=10, help='concurrent /video_feed clients')
+    parser.add_argument('--viewer-path', default='/video_feed',
+                        help="stream path, e.g. '/video_feed?overlay=1&client={client}'")
+    parser.add_argument('--pollers', type=int, default=2, help='dashboard clients polling /logs, /updates, /camera_status')
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--switchers', type=int, default=0, help='clients calling /switch_camera')
+    parser.add_argument('--switch-interval', type=float, default=10.0)
+    parser.add_argument('--subscribers', type=int, default=0, help='/detections event-stream clients')
+    parser.add_argument('--source', choices=['test_video.mp4', 'demo'], help='switch the server to this source first')
+    parser.add_argument('--wait-ready', type=float, default=0, help='wait up to N seconds for /readyz first')
+    parser.add_argument('--json', help='also write the report to this file')
+    parser.add_argument('--min-fps', type=float, help='exit non-zero if any viewer gets fewer FPS')
+    parser.add_argument('--max-age-p99', type=float, help='exit non-zero if p99 frame age exceeds N ms')
+    args = parser.parse_args()
+
+    test = LoadTest(args.url, args.duration, warmup=args.warmup)
+    test.prepare(args.source, args.wait_ready)
+    print(f"Running {args.viewers} viewers, {args.pollers} pollers, {args.switchers} switchers, "
+          f"{args.subscribers} subscribers for {args.duration:.0f}s against {args.url}")
+    report = test.run(
+        viewers=args.viewers,
+        viewer_path=args.viewer_path,
+        pollers=args.pollers,
+        poll_interval=args.poll_interval,
+        switchers=args.switchers,
+        switch_interval=args.switch_interval,
+        subscribers=args.subscribers
+    )
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    # Regression gates
+    failed = False
+    if args.min_fps is not None and report['viewers']['fps']['min'] is not None \
+            and report['viewers']['fps']['min'] < args.min_fps:
+        print(f"FAIL: slowest viewer got {report['viewers']['fps']['min']} FPS < {args.min_fps}")
+        failed = True
+    age = report['viewers']['frame_age_ms']
+    if args.max_age_p99 is not None and age['count'] and age['p99'] > args.max_age_p99:
+        print(f"FAIL: p99 frame age {age['p99']}ms > {args.max_age_p99}ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+// 客户端检测框叠加：服务器只推送原始帧，检测元数据通过 /detections 单独下发，
+// 浏览器按帧序号 (X-Frame-Seq) 将检测框绘制到 canvas 上
+class DetectionOverlay {
+    constructor(canvas, options = {}) {
+        this.canvas = canvas;
+        this.ctx = canvas.getContext('2d');
+        this.stream = options.stream || 0;
+        this.clientId = options.clientId || Math.random().toString(36).slice(2, 10);
+        this.layers = { boxes: true, labels: true, trackIds: true };
+        this.names = {};
+        this.metadata = new Map();   // seq -> 检测元数据
+        this.maxMetadata = 120;
+        this.frame = null;           // 当前显示的帧 { seq, bitmap }
+        this.events = null;
+        this.abort = null;
+    }
+
+    start() {
+        this.stop();
+        const query = `stream=${this.stream}&client=${this.clientId}`;
+
+        // 先订阅元数据，保证第一帧到达时检测结果已在路上
+        this.events = new EventSource(`/detections?${query}`);
+        this.events.addEventListener('names', (event) => {
+            this.names = JSON.parse(event.data);
+        });
+        this.events.onmessage = (event) => this.onMetadata(JSON.parse(event.data));
+
+        this.abort = new AbortController();
+        fetch(`/video_feed?overlay=1&${query}`, { signal: this.abort.signal })
+            .then(response => this.readFrames(response.body.getReader()))
+            .catch(error => {
+                if (error.name !== 'AbortError') {
+                    console.error('Overlay stream error:', error);
+                }
+            });
+    }
+
+    stop() {
+        if (this.events) {
+            this.events.close();
+            this.events = null;
+        }
+        if (this.abort) {
+            this.abort.abort();
+            this.abort = null;
+        }
+        this.metadata.clear();
+    }
+
+    setLayer(layer, enabled) {
+        this.layers[layer] = enabled;
+        // 图层切换只需重绘本地缓存的帧，无需请求服务器
+        this.render();
+    }
+
+    onMetadata(meta) {
+        this.metadata.set(meta.seq, meta);
+        if (this.metadata.size > this.maxMetadata) {
+            this.metadata.delete(this.metadata.keys().next().value);
+        }
+        // 元数据晚于对应帧到达时补画
+        if (this.frame && this.frame.seq === meta.seq) {
+            this.render();
+        }
+    }
+
+    async readFrames(reader) {
+        // 解析 multipart/x-mixed-replace：每个分段带 Content-Length 和 X-Frame-Seq 头
+        const decoder = new TextDecoder();
+        let buffer = new Uint8Array(0);
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer = this.concat(buffer, value);
+
+            while (true) {
+                const headerEnd = this.indexOf(buffer, [13, 10, 13, 10]);
+                if (headerEnd < 0) break;
+                const headers = this.parseHeaders(decoder.decode(buffer.subarray(0, headerEnd)));
+                const length = parseInt(headers['content-length'], 10);
+                const bodyStart = headerEnd + 4;
+                if (isNaN(length) || buffer.length < bodyStart + length) break;
+
+                const jpeg = buffer.slice(bodyStart, bodyStart + length);
+                buffer = buffer.slice(bodyStart + length);
+                await this.showFrame(parseInt(headers['x-frame-seq'], 10), jpeg);
+            }
+        }
+    }
+
+    async showFrame(seq, jpeg) {
+        const bitmap = await createImageBitmap(new Blob([jpeg], { type: 'image/jpeg' }));
+        if (this.frame) {
+            this.frame.bitmap.close();
+        }
+        this.frame = { seq, bitmap };
+        this.render();
+    }
+
+    render() {
+        if (!this.frame) return;
+        const { bitmap } = this.frame;
+        if (this.canvas.width !== bitmap.width || this.canvas.height !== bitmap.height) {
+            this.canvas.width = bitmap.width;
+            this.canvas.height = bitmap.height;
+        }
+        this.ctx.drawImage(bitmap, 0, 0);
+
+        const meta = this.metadataFor(this.frame.seq);
+        if (!meta || !this.layers.boxes) return;
+
+        this.ctx.lineWidth = 2;
+        this.ctx.font = '14px sans-serif';
+        meta.boxes.forEach(([x1, y1, x2, y2, conf, cls, trackId]) => {
+            const color = this.colorFor(cls);
+            this.ctx.strokeStyle = color;
+            this.ctx.strokeRect(x1, y1, x2 - x1, y2 - y1);
+
+            let label = '';
+            if (this.layers.trackIds && trackId >= 0) {
+                label += `#${trackId} `;
+            }
+            if (this.layers.labels) {
+                label += `${this.names[cls] || cls} ${conf.toFixed(2)}`;
+            }
+            if (label) {
+                const width = this.ctx.measureText(label).width + 6;
+                this.ctx.fillStyle = color;
+                this.ctx.fillRect(x1, Math.max(y1 - 18, 0), width, 18);
+                this.ctx.fillStyle = '#ffffff';
+                this.ctx.fillText(label.trim(), x1 + 3, Math.max(y1 - 4, 14));
+            }
+        });
+    }
+
+    metadataFor(seq) {
+        // 优先使用同序号的结果；否则沿用不晚于该帧的最近一次结果（检测步长 > 1 时）
+        if (this.metadata.has(seq)) {
+            return this.metadata.get(seq);
+        }
+        let best = null;
+        this.metadata.forEach((meta, metaSeq) => {
+            if (metaSeq <= seq && (!best || metaSeq > best.seq)) {
+                best = meta;
+            }
+        });
+        return best;
+    }
+
+    colorFor(cls) {
+        const colors = ['#ff3838', '#ff9d97', '#ff701f', '#ffb21d', '#cfd231', '#48f90a',
+                        '#92cc17', '#3ddb86', '#00bcd4', '#0063d1', '#00c2ff', '#344593',
+                        '#6473ff', '#0018ec', '#8438ff', '#520085'];
+        return colors[cls % colors.length];
+    }
+
+    parseHeaders(text) {
+        const headers = {};
+        text.split('\r\n').forEach(line => {
+            const index = line.indexOf(':');
+            if (index > 0) {
+                headers[line.slice(0, index).trim().toLowerCase()] = line.slice(index + 1).trim();
+            }
+        });
+        return headers;
+    }
+
+    concat(a, b) {
+        const result = new Uint8Array(a.length + b.length);
+        result.set(a, 0);
+        result.set(b, a.length);
+        return result;
+    }
+
+    indexOf(buffer, pattern) {
+        outer:
+        for (let i = 0; i <= buffer.length - pattern.length; i++) {
+            for (let j = 0; j < pattern.length; j++) {
+                if (buffer[i + j] !== pattern[j]) continue outer;
+            }
+            return i;
+        }
+        return -1;
+    }
+}
+
+// 客户端叠加模式切换
+function toggleClientOverlay(enabled) {
+    const image = document.getElementById('video-feed');
+    const canvas = document.getElementById('overlay-canvas');
+    if (!image || !canvas) return;
+
+    if (!window.detectionOverlay) {
+        window.detectionOverlay = new DetectionOverlay(canvas);
+    }
+    if (enabled) {
+        image.src = '';
+        image.classList.add('hidden');
+        canvas.classList.remove('hidden');
+        window.detectionOverlay.start();
+    } else {
+        window.detectionOverlay.stop();
+        canvas.classList.add('hidden');
+        image.classList.remove('hidden');
+        image.src = '/video_feed?t=' + Date.now();
+    }
+}
+
+function toggleOverlayLayer(layer, enabled) {
+    if (window.detectionOverlay) {
+        window.detectionOverlay.setLayer(layer, enabled);
+    }
+}
@@ -0,0 +1,67 @@
+import threading
+import queue
+import json
+
+# Client-side overlay mode: the server streams frames without baked-in boxes and
+# publishes compact per-frame detection metadata on a separate channel, matched
+# by frame sequence number in the browser
+
+
+class DetectionHub:
+    """Fan-out of detection metadata to subscribers of a channel.
+
+    Each subscriber gets a small bounded queue; when a slow client falls behind,
+    its oldest messages are dropped instead of blocking the video loop.
+    """
+
+    def __init__(self, max_pending=60):
+        self.max_pending = max_pending
+        self.channels = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscriber = queue.Queue(maxsize=self.max_pending)
+        with self.lock:
+            self.channels.setdefault(channel, []).append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, channel, subscriber):
+        with self.lock:
+            subscribers = self.channels.get(channel, [])
+            if subscriber in subscribers:
+                subscribers.remove(subscriber)
+            if not subscribers:
+                self.channels.pop(channel, None)
+
+    def has_subscribers(self, channel):
+        with self.lock:
+            return bool(self.channels.get(channel))
+
+    def publish(self, channel, message):
+        with self.lock:
+            subscribers = list(self.channels.get(channel, []))
+        for subscriber in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait(message)
+                    break
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+
+
+def to_message(seq, dets, shape):
+    """Compact JSON for one frame: boxes as [x1, y1, x2, y2, conf, cls, track_id]"""
+    boxes = [
+        [int(x1), int(y1), int(x2), int(y2), round(float(conf), 2), int(cls), int(track_id)]
+        for x1, y1, x2, y2, conf, cls, track_id in dets
+    ]
+    return json.dumps({'seq': seq, 'w': shape[1], 'h': shape[0], 'boxes': boxes}, separators=(',', ':'))
+
+
+def sse(data, event=None):
+    """Format one server-sent event"""
+    prefix = f'event: {event}\n' if event else ''
+    return f'{prefix}data: {data}\n\n'
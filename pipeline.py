@@ -0,0 +1,412 @@
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import threading
+import queue
+import time
+import cv2
+import numpy as np
+import detections
+import os
+
+# Multi-process mode: capture processes write frames into shared-memory ring
+# buffers, inference processes read them by slot index, annotate and JPEG-encode
+# them, and only slot indices, compact detection arrays and JPEG bytes travel
+# through queues. Raw frames are never pickled.
+PIPELINE_MODE = os.getenv('PIPELINE_MODE', '0') == '1'
+PIPELINE_WORKERS = int(os.getenv('PIPELINE_WORKERS', '0'))  # 0 = derive from cpu count
+PIPELINE_SOURCES = [s for s in os.getenv('PIPELINE_SOURCES', '').split(',') if s]
+DEFAULT_FRAME_SHAPE = (480, 640)  # ring size for sources whose frame size cannot be probed
+MAX_SHARED_DETECTIONS = 300  # boxes per stream kept for frames that skip detection
+
+
+class SharedDetections:
+    """Latest detections of every stream, shared by the inference processes.
+
+    Frames skipped by the detection stride are still annotated and encoded,
+    with the most recent detections of their stream, whichever worker made them.
+    """
+
+    def __init__(self, ctx, streams, max_dets=MAX_SHARED_DETECTIONS):
+        self.streams = streams
+        self.max_dets = max_dets
+        self.lock = ctx.Lock()
+        self.counts = ctx.Array('i', streams, lock=False)
+        self.rows = ctx.Array('f', streams * max_dets * detections.DETECTION_COLUMNS, lock=False)
+
+    def _view(self):
+        return np.frombuffer(self.rows, dtype=np.float32).reshape(
+            self.streams, self.max_dets, detections.DETECTION_COLUMNS)
+
+    def store(self, stream_index, dets):
+        count = min(len(dets), self.max_dets)
+        with self.lock:
+            self._view()[stream_index, :count] = dets[:count]
+            self.counts[stream_index] = count
+
+    def load(self, stream_index):
+        with self.lock:
+            return self._view()[stream_index, :self.counts[stream_index]].copy()
+
+
+class FrameRing:
+    """A fixed number of HxWx3 uint8 frame slots in one shared memory block"""
+
+    def __init__(self, slots, shape, name=None):
+        self.slots = slots
+        self.shape = tuple(shape)
+        size = slots * int(np.prod(self.shape))
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=self.shm.buf)
+
+    def spec(self):
+        """Picklable description used by other processes to attach to this ring"""
+        return self.shm.name, self.slots, self.shape
+
+    @classmethod
+    def attach(cls, spec):
+        name, slots, shape = spec
+        return cls(slots, shape, name=name)
+
+    def close(self):
+        # Views into the buffer must be dropped before the mapping can be closed
+        self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def parse_source(source):
+    """Camera indices arrive as strings from the environment"""
+    if isinstance(source, str) and source.isdigit():
+        return int(source)
+    return source
+
+
+def probe_frames(source):
+    """((height, width), fps) of the frames the capture backend delivers for a source; Nones if unknown"""
+    import capture
+    camera = None
+    try:
+        camera = capture.open_source(source)
+        success, frame = camera.read()
+        if success:
+            return frame.shape[:2], camera.get(cv2.CAP_PROP_FPS) or None
+    except Exception as e:
+        print(f"Could not probe frame size of {source}: {e}")
+    finally:
+        if camera is not None:
+            camera.release()
+    return None, None
+
+
+def _capture_worker(stream_index, source, ring_spec, free_slots, work_queue, stop_event, strides, imgsizes):
+    """Capture process: decode frames into free ring slots and announce them by index"""
+    import capture
+    cv2.setNumThreads(1)
+    ring = FrameRing.attach(ring_spec)
+    height, width = ring.shape[:2]
+    camera = capture.open_source(source)
+    is_file = isinstance(source, str) and os.path.exists(source)
+    frame_interval = 1.0 / (camera.get(cv2.CAP_PROP_FPS) or 30)
+    seq = 0
+    dropped = 0
+    until_detection = 0  # frames to send before the next one that runs detection
+
+    try:
+        while not stop_event.is_set():
+            started = time.time()
+            success, frame = camera.read()
+            if not success:
+                if is_file and not isinstance(camera, capture.FFmpegCapture):
+                    # Loop video files like a live source
+                    camera.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                else:
+                    time.sleep(0.1)
+                continue
+
+            try:
+                slot = free_slots.get_nowait()
+            except queue.Empty:
+                # Every slot is still being processed: drop the frame to stay real-time
+                dropped += 1
+                continue
+
+            target = ring.frames[slot]
+            if frame.shape == target.shape:
+                np.copyto(target, frame)
+            else:
+                # Only when the source changed size after the ring was sized
+                cv2.resize(frame, (width, height), dst=target)
+            seq += 1
+            # Every frame is encoded; the detection stride from the load-shedding controller
+            # only decides which frames run the model
+            detect = until_detection <= 0
+            until_detection = max(1, strides[stream_index]) - 1 if detect else until_detection - 1
+            work_queue.put((stream_index, slot, seq, time.time(), imgsizes[stream_index], detect))
+
+            if is_file and not isinstance(camera, capture.FFmpegCapture):
+                # OpenCV reads files as fast as possible; pace them at their native rate
+                remaining = frame_interval - (time.time() - started)
+                if remaining > 0:
+                    time.sleep(remaining)
+    finally:
+        print(f"Capture worker {stream_index} stopped ({seq} frames, {dropped} dropped)")
+        camera.release()
+        target = None
+        ring.close()
+
+
+def _inference_worker(worker_id, ring_specs, free_slots, work_queue, result_queue, stop_event, model_path,
+                      predict_kwargs, qualities, annotations, shared_detections, hold_detections):
+    """Inference process: run the model on ring slots (or reuse the stream's last detections
+    for frames skipped by the stride), annotate and encode them in place, and post back the
+    detection array with the JPEG bytes"""
+    # One intra-op thread per process so throughput scales with the number of processes
+    cv2.setNumThreads(1)
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+
+    from ultralytics import YOLO
+    model = YOLO(model_path)
+    names = dict(model.names)
+    rings = [FrameRing.attach(spec) for spec in ring_specs]
+    result_queue.put(('names', worker_id, names))
+
+    try:
+        while not stop_event.is_set():
+            try:
+                stream_index, slot, seq, captured_at, imgsz, detect = work_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            frame = rings[stream_index].frames[slot]
+            if detect:
+                kwargs = dict(predict_kwargs, imgsz=imgsz) if imgsz else predict_kwargs
+                results = model.predict(frame, verbose=False, **kwargs)
+                dets = detections.to_array(results[0]) if results else detections.empty()
+                results = None
+                shared_detections.store(stream_index, dets)
+            else:
+                dets = shared_detections.load(stream_index)
+
+            # Annotation and JPEG quality are set per stream by the load-shedding controller
+            if len(dets) and annotations[stream_index]:
+                detections.draw(frame, dets, names)
+            ret, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), qualities[stream_index]])
+            shape = frame.shape
+            frame = None
+
+            # Frames with fresh detections stay in their slot until the main process took its evidence screenshot
+            held = slot if hold_detections and detect and len(dets) else None
+            if held is None:
+                free_slots[stream_index].put(slot)
+            result_queue.put(('result', stream_index, seq, captured_at, dets, buffer.tobytes(), shape, held))
+    finally:
+        for ring in rings:
+            ring.close()
+
+
+class Pipeline:
+    """Multi-process capture and inference pipeline for one or more streams.
+
+    Inference processes annotate and JPEG-encode frames where they sit in the
+    ring, so the main process only receives encoded bytes and publishes them.
+    Rings are sized from each source's probed frame size unless frame_shape
+    is given.
+    """
+
+    def __init__(self, sources, workers=None, frame_shape=None, slots_per_stream=None,
+                 model_path='yolov8n.pt', predict_kwargs=None, jpeg_quality=90, on_detection=None,
+                 controller=None, priorities=None, on_frame=None, annotate=True):
+        self.sources = [parse_source(s) for s in sources]
+        self.stream_names = [str(s) for s in self.sources]
+        if not workers:
+            workers = max(1, (os.cpu_count() or 2) - len(self.sources) - 1)
+        self.workers = workers
+        self.frame_shape = tuple(frame_shape) if frame_shape else None
+        self.slots_per_stream = slots_per_stream or max(4, 2 * workers // len(self.sources) + 2)
+        self.model_path = model_path
+        self.predict_kwargs = predict_kwargs or {}
+        self.jpeg_quality = jpeg_quality
+        self.on_detection = on_detection
+        self.on_frame = on_frame
+        self.annotate = annotate
+        self.controller = controller
+        self.priorities = priorities or {}
+
+        self.ctx = mp.get_context('spawn')
+        self.stop_event = self.ctx.Event()
+        self.work_queue = self.ctx.Queue()
+        self.result_queue = self.ctx.Queue()
+        self.rings = []
+        self.free_slots = []
+        self.processes = []
+        self.names = {}
+        self.loaded_workers = set()  # inference workers that posted their class names, i.e. loaded the model
+        # Per-stream knobs read by the capture processes
+        self.strides = self.ctx.Array('i', [1] * len(self.sources), lock=False)
+        self.imgsizes = self.ctx.Array('i', [self.predict_kwargs.get('imgsz', 640)] * len(self.sources), lock=False)
+        # ... and by the inference processes
+        self.qualities = self.ctx.Array('i', [jpeg_quality] * len(self.sources), lock=False)
+        self.annotations = self.ctx.Array('i', [int(annotate)] * len(self.sources), lock=False)
+        max_det = self.predict_kwargs.get('max_det')
+        self.shared_detections = SharedDetections(self.ctx, len(self.sources), max_det or MAX_SHARED_DETECTIONS)
+
+        self.condition = threading.Condition()
+        self.latest = [(0, None, 0.0) for _ in self.sources]  # (seq, jpeg bytes, captured_at)
+        self.counters = {'frames': 0, 'stale': 0}
+        self.consumer = None
+
+    def start(self):
+        for index, source in enumerate(self.sources):
+            shape, source_fps = probe_frames(source)
+            shape = self.frame_shape or shape or DEFAULT_FRAME_SHAPE
+            ring = FrameRing(self.slots_per_stream, tuple(shape) + (3,))
+            print(f"Stream {index} ({source}): ring of {ring.slots} {shape[1]}x{shape[0]} frames")
+            if self.controller:
+                # Frames are processed in parallel: judge the stream by throughput, not per-frame latency
+                name = self.stream_names[index]
+                self.controller.register(name, self.priorities.get(name, 'normal'), source_fps, metric='throughput')
+            free_slots = self.ctx.Queue()
+            for slot in range(ring.slots):
+                free_slots.put(slot)
+            self.rings.append(ring)
+            self.free_slots.append(free_slots)
+
+        ring_specs = [ring.spec() for ring in self.rings]
+        for worker_id in range(self.workers):
+            process = self.ctx.Process(
+                target=_inference_worker,
+                args=(worker_id, ring_specs, self.free_slots, self.work_queue, self.result_queue, self.stop_event,
+                      self.model_path, self.predict_kwargs, self.qualities, self.annotations,
+                      self.shared_detections, self.on_detection is not None),
+                daemon=True
+            )
+            process.start()
+            self.processes.append(process)
+
+        for index, source in enumerate(self.sources):
+            process = self.ctx.Process(
+                target=_capture_worker,
+                args=(index, source, ring_specs[index], self.free_slots[index], self.work_queue, self.stop_event,
+                      self.strides, self.imgsizes),
+                daemon=True
+            )
+            process.start()
+            self.processes.append(process)
+
+        self.consumer = threading.Thread(target=self._consume, daemon=True)
+        self.consumer.start()
+        print(f"Pipeline started: {len(self.sources)} stream(s), {self.workers} inference worker(s)")
+
+    def _consume(self):
+        last_seq = [0] * len(self.sources)
+        while not self.stop_event.is_set():
+            try:
+                message = self.result_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+
+            if message[0] == 'names':
+                with self.condition:
+                    self.names = message[2]
+                    self.loaded_workers.add(message[1])
+                    self.condition.notify_all()
+                continue
+
+            _, stream_index, seq, captured_at, dets, frame_bytes, shape, held = message
+            self._apply_knobs(stream_index, captured_at)
+            if held is not None:
+                # Fresh detections produce evidence even when a faster, detection-less frame
+                # overtook them; the frame is only valid for the duration of the callback
+                frame = self.rings[stream_index].frames[held]
+                self.on_detection(stream_index, frame, dets, self.names)
+                frame = None
+                self.free_slots[stream_index].put(held)
+
+            if seq <= last_seq[stream_index]:
+                # A newer frame of this stream was already published
+                self.counters['stale'] += 1
+                continue
+            last_seq[stream_index] = seq
+            if self.on_frame:
+                self.on_frame(stream_index, seq, frame_bytes, captured_at, dets, shape)
+
+            with self.condition:
+                self.latest[stream_index] = (seq, frame_bytes, captured_at)
+                self.counters['frames'] += 1
+                self.condition.notify_all()
+
+    def _apply_knobs(self, stream_index, captured_at):
+        """Report the processed frame to the controller and push its knobs to the worker processes"""
+        if not self.controller:
+            return
+        name = self.stream_names[stream_index]
+        self.controller.report(name, time.time() - captured_at, self.queue_depth())
+        knobs = self.controller.knobs(name)
+        self.strides[stream_index] = knobs['stride']
+        self.imgsizes[stream_index] = knobs['imgsz']
+        self.qualities[stream_index] = knobs['jpeg_quality']
+        self.annotations[stream_index] = int(knobs['annotate'] and self.annotate)
+
+    def latest_frame(self, stream_index=0, after_seq=0, timeout=1.0):
+        """Block until a frame newer than after_seq is available; returns (seq, jpeg, captured_at)"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.latest[stream_index][0] > after_seq, timeout=timeout)
+            return self.latest[stream_index]
+
+    def wait_ready(self, timeout=None):
+        """Block until every inference worker has loaded its model.
+
+        Returns False if a worker died first or the timeout expired.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        inference_processes = self.processes[:self.workers]
+        with self.condition:
+            while len(self.loaded_workers) < self.workers:
+                if any(not p.is_alive() for p in inference_processes):
+                    return False
+                if deadline is not None and time.time() >= deadline:
+                    return False
+                self.condition.wait(timeout=0.5)
+        return True
+
+    def queue_depth(self):
+        try:
+            return self.work_queue.qsize()
+        except NotImplementedError:
+            # qsize() is not available on macOS
+            return -1
+
+    def stats(self):
+        return {
+            'streams': len(self.sources),
+            'workers': self.workers,
+            'ready_workers': len(self.loaded_workers),
+            'frames': self.counters['frames'],
+            'stale': self.counters['stale'],
+            'queue_depth': self.queue_depth(),
+            'alive': sum(1 for p in self.processes if p.is_alive())
+        }
+
+    def stop(self):
+        self.stop_event.set()
+        for process in self.processes:
+            process.join(timeout=3)
+            if process.is_alive():
+                process.terminate()
+        if self.consumer:
+            self.consumer.join(timeout=2)
+        for ring in self.rings:
+            ring.close()
+        self.rings = []
+        print("Pipeline stopped")